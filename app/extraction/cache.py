@@ -0,0 +1,339 @@
+import abc
+import asyncio
+import collections
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import AsyncIterator, Callable, Collection, Iterator, TypeVar
+
+from llama_index.core.llms import LLM
+from llama_index.core.prompts import BasePromptTemplate
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+CACHE_ROOT = os.getenv("CACHE_ROOT", os.path.join(tempfile.gettempdir(), "invoice-reconciler"))
+FILE_CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+PREDICTION_CACHE_TTL_SECONDS = int(os.getenv("PREDICTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "20000"))
+
+Model = TypeVar("Model", bound=BaseModel)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# Set while re-extracting a suspect document: predictions are recomputed (and re-stored) instead of read from the cache
+_refresh_predictions = contextvars.ContextVar("refresh_predictions", default=False)
+
+
+@contextlib.contextmanager
+def refresh_predictions() -> Iterator[None]:
+    """Within this block (and the tasks it starts), CachedStructuredLLM ignores cached predictions."""
+    token = _refresh_predictions.set(True)
+    try:
+        yield
+    finally:
+        _refresh_predictions.reset(token)
+
+
+def file_sha256(file_path: str | Path) -> str:
+    """Hex sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _evict_lru(
+    entries: list[tuple[float, str, int]], max_bytes: int, remove: Callable[[str], None], keep: Collection[str] = (),
+) -> None:
+    """Removes `(last_used, key, size)` entries, oldest first and except those in `keep`, until the total size fits in `max_bytes`."""
+    total = sum(size for _, _, size in entries)
+    for _, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key in keep:
+            continue
+        remove(key)
+        total -= size
+
+
+class CachedFile(BaseModel):
+    path: str
+    filename: str
+    size: int
+    mtime_ns: int | None = None  # Of the cached bytes when stored; entries without it predate it and are downloaded again
+
+
+class FileCache:
+    """
+    On-disk cache of downloaded LlamaCloud files, keyed by file_id.
+    Layout: `<root>/<file_id>/<filename>` holds the bytes and `<root>/<file_id>.json` the manifest (name, size, mtime).
+    Entries are checked on every read (size and modification time) and evicted least-recently-used first once the cache
+    exceeds `max_bytes`. Files of running workflows (`in_use`) are never evicted, even if a batch alone exceeds the cap.
+    """
+
+    # file_id -> number of workflow runs using it, process-wide
+    _in_use: collections.Counter = collections.Counter()
+
+    @classmethod
+    @contextlib.contextmanager
+    def in_use(cls, file_ids: Collection[str]) -> Iterator[None]:
+        """Protects the files of a workflow run from eviction until it ends."""
+        file_ids = set(file_ids)
+        cls._in_use.update(file_ids)
+        try:
+            yield
+        finally:
+            cls._in_use.subtract(file_ids)
+            cls._in_use += collections.Counter()  # Drops ids no run uses anymore
+
+    def __init__(self, root: str | Path = None, max_bytes: int = FILE_CACHE_MAX_BYTES):
+        self.root = Path(root or os.path.join(CACHE_ROOT, "files"))
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _manifest_path(self, file_id: str) -> Path:
+        return self.root / f"{file_id}.json"
+
+    def _entry_dir(self, file_id: str) -> Path:
+        return self.root / file_id
+
+    def get(self, file_id: str) -> CachedFile | None:
+        """Returns the cached file if present and intact, dropping corrupt entries."""
+        manifest_path = self._manifest_path(file_id)
+        try:
+            cached = CachedFile.model_validate_json(manifest_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+        path = Path(cached.path)
+        try:
+            stat = path.stat()
+        except OSError:
+            stat = None
+        # Checked by size and mtime rather than a content hash: a rewrite changes one of them, and hashing would cost a full read
+        if stat is None or stat.st_size != cached.size or stat.st_mtime_ns != cached.mtime_ns:
+            logger.warning(f"Discarding corrupt cache entry for {file_id}")
+            self.invalidate(file_id)
+            return None
+
+        # The manifest mtime is the LRU clock
+        os.utime(manifest_path)
+        return cached
+
+    async def store(self, file_id: str, filename: str, chunks: AsyncIterator[bytes], expected_size: int | None = None) -> CachedFile:
+        """Streams `chunks` into the cache and publishes the entry atomically. Disk work runs in worker threads."""
+        entry_dir = self._entry_dir(file_id)
+        path = entry_dir / Path(filename).name
+
+        size = 0
+        fd, part_path = await asyncio.to_thread(self._open_part, entry_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    await asyncio.to_thread(f.write, chunk)
+                    size += len(chunk)
+
+            if expected_size is not None and size != expected_size:
+                raise ValueError(f"Downloaded {size} bytes for {filename}, expected {expected_size}")
+
+            return await asyncio.to_thread(self._publish, file_id, filename, part_path, path, size)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    @staticmethod
+    def _open_part(entry_dir: Path) -> tuple[int, str]:
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        return tempfile.mkstemp(dir=entry_dir, suffix=".part")
+
+    def _publish(self, file_id: str, filename: str, part_path: str, path: Path, size: int) -> CachedFile:
+        """Moves a complete download into place, writes its manifest, then evicts to make room."""
+        os.replace(part_path, path)
+        cached = CachedFile(path=str(path), filename=filename, size=size, mtime_ns=path.stat().st_mtime_ns)
+        manifest_path = self._manifest_path(file_id)
+        tmp_manifest = manifest_path.with_suffix(".json.part")
+        tmp_manifest.write_text(cached.model_dump_json())
+        os.replace(tmp_manifest, manifest_path)
+
+        self.evict(keep={file_id})
+        return cached
+
+    def invalidate(self, file_id: str) -> None:
+        self._manifest_path(file_id).unlink(missing_ok=True)
+        shutil.rmtree(self._entry_dir(file_id), ignore_errors=True)
+
+    def evict(self, keep: Collection[str] = ()) -> None:
+        """Removes least-recently-used entries, except files in use and `keep`, until the cache fits in `max_bytes`."""
+        entries = []
+        for manifest_path in self.root.glob("*.json"):
+            try:
+                cached = CachedFile.model_validate_json(manifest_path.read_text())
+                entries.append((manifest_path.stat().st_mtime, manifest_path.stem, cached.size))
+            except (OSError, ValueError):
+                continue
+
+        _evict_lru(entries, self.max_bytes, self.invalidate, keep={*keep, *self._in_use})
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed document text, keyed by content hash plus parser settings.
+    Each entry is a single `<root>/<key>.md` file; least-recently-used entries are evicted once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, root: str | Path = None, max_bytes: int = PARSE_CACHE_MAX_BYTES):
+        self.root = Path(root or os.path.join(CACHE_ROOT, "parsed"))
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(content_hash: str, *settings: str) -> str:
+        return hashlib.sha256("|".join([content_hash, *settings]).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.md"
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            text = path.read_text(encoding="utf-8")
+        except OSError:
+            return None
+        os.utime(path)
+        return text
+
+    def set(self, key: str, text: str) -> None:
+        path = self._path(key)
+        tmp_path = path.with_suffix(".md.part")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+        self.evict(keep={key})
+
+    def invalidate(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def evict(self, keep: Collection[str] = ()) -> None:
+        entries = []
+        for path in self.root.glob("*.md"):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.stem, stat.st_size))
+            except OSError:
+                continue
+        _evict_lru(entries, self.max_bytes, self.invalidate, keep=keep)
+
+
+class PredictionCache(abc.ABC):
+    """Storage interface for memoized structured predictions. Values are JSON strings."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> str | None:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str) -> None:
+        ...
+
+
+class SQLitePredictionCache(PredictionCache):
+    """
+    Prediction cache in a standalone SQLite file.
+    Entries expire after `ttl_seconds`; beyond `max_entries` the least recently read ones are dropped.
+    """
+
+    def __init__(
+        self,
+        path: str | Path = None,
+        ttl_seconds: int = PREDICTION_CACHE_TTL_SECONDS,
+        max_entries: int = PREDICTION_CACHE_MAX_ENTRIES,
+    ):
+        path = Path(path or os.path.join(CACHE_ROOT, "predictions.sqlite"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_predictions_accessed_at ON predictions (accessed_at)")
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created_at FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE predictions SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._conn.execute("DELETE FROM predictions WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM predictions WHERE key IN "
+                "(SELECT key FROM predictions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class CachedStructuredLLM:
+    """
+    Memoizes `astructured_predict` of a deterministic LLM.
+    The key covers the model and its settings, the output schema, the prompt template and the rendered variables.
+    """
+
+    def __init__(self, llm: LLM, cache: PredictionCache):
+        self.llm = llm
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, output_cls: type[BaseModel], prompt: BasePromptTemplate, prompt_args: dict) -> str:
+        payload = json.dumps(
+            {
+                "model": self.llm.metadata.model_name,
+                "temperature": getattr(self.llm, "temperature", None),
+                "schema": output_cls.model_json_schema(),
+                "template": prompt.get_template(),
+                "variables": prompt_args,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def astructured_predict(self, output_cls: type[Model], prompt: BasePromptTemplate, **prompt_args) -> Model:
+        key = self._key(output_cls, prompt, prompt_args)
+        if not _refresh_predictions.get() and (cached := await asyncio.to_thread(self.cache.get, key)) is not None:
+            self.hits += 1
+            logger.debug(f"Prediction cache hit for {output_cls.__name__} (hits={self.hits}, misses={self.misses})")
+            return output_cls.model_validate_json(cached)
+
+        self.misses += 1
+        result = await self.llm.astructured_predict(output_cls, prompt, **prompt_args)
+        await asyncio.to_thread(self.cache.set, key, result.model_dump_json())
+        return result
@@ -8,6 +8,23 @@ from llama_cloud_services.beta.sheets import LlamaSheets
 from llama_cloud_services.parse import LlamaParse, ResultType
 from llama_index.llms.openai import OpenAI
 
+from app.extraction.cache import (
+    CachedStructuredLLM,
+    PredictionCache,
+    SQLitePredictionCache,
+)
+from app.extraction.ratelimit import SAFE_POST_PATHS, RateLimitedTransport, get_limiter
+
+
+def _rate_limited_httpx_client(provider: str) -> httpx.AsyncClient:
+    """
+    An httpx client whose requests share the process-wide limiter of `provider`.
+    It retries throttled requests, server errors and failed connections itself (see RateLimitedTransport),
+    so SDKs given this client must not retry on top of it (max_retries=0).
+    """
+    transport = RateLimitedTransport(get_limiter(provider), safe_post_paths=SAFE_POST_PATHS[provider])
+    return httpx.AsyncClient(transport=transport, timeout=60)
+
 
 @functools.lru_cache(maxsize=None)
 def get_llama_cloud_client() -> AsyncLlamaCloud:
@@ -18,6 +35,7 @@ def get_llama_cloud_client() -> AsyncLlamaCloud:
         token=token,
         base_url=os.getenv("LLAMA_CLOUD_BASE_URL"),
         timeout=60,
+        httpx_client=_rate_limited_httpx_client("llama_cloud"),
     )
 
 
@@ -26,6 +44,8 @@ def get_sheets_client() -> LlamaSheets:
     return LlamaSheets(
         api_key=os.getenv("LLAMA_CLOUD_API_KEY"),
         base_url=os.getenv("LLAMA_CLOUD_BASE_URL"),
+        max_retries=0,
+        async_httpx_client=_rate_limited_httpx_client("llama_sheets"),
     )
 
 
@@ -43,6 +63,7 @@ def get_parser() -> LlamaParse:
         api_key=os.getenv("LLAMA_CLOUD_API_KEY"),
         result_type=ResultType.MD,
         verbose=True,
+        custom_client=_rate_limited_httpx_client("llama_cloud"),
     )
 
 
@@ -50,7 +71,25 @@ def get_parser() -> LlamaParse:
 def get_llm() -> OpenAI:
     if not os.getenv("OPENAI_API_KEY"):
         raise ValueError("OPENAI_API_KEY is not set")
-    return OpenAI(model="gpt-4.1-mini", temperature=0)
+    return OpenAI(
+        model="gpt-4.1-mini", temperature=0, max_retries=0, async_http_client=_rate_limited_httpx_client("openai")
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_prediction_cache() -> PredictionCache:
+    return SQLitePredictionCache()
+
+
+@functools.lru_cache(maxsize=None)
+def get_structured_llm() -> CachedStructuredLLM:
+    """The LLM wrapped with the prediction cache. Use it for every structured prediction."""
+    return CachedStructuredLLM(get_llm(), get_prediction_cache())
+
+
+def get_structured_llm_if_created() -> CachedStructuredLLM | None:
+    """The structured LLM if something already used it, without creating it (which needs OPENAI_API_KEY)."""
+    return get_structured_llm() if get_structured_llm.cache_info().currsize else None
 
 
 @functools.lru_cache(maxsize=None)
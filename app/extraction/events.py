@@ -1,7 +1,7 @@
-from typing import List, Literal, Any, Dict
+from typing import List, Literal, Any, Dict, Tuple
 from pydantic import BaseModel
 from workflows.events import Event, StartEvent
-from app.extraction.schemas import DocumentClassification, ProcessingResult, InvoiceData, DocumentCategory
+from app.extraction.schemas import DocumentClassification, ProcessingResult, InvoiceData, DocumentCategory, Discrepancy
 
 
 class FilesUploadedEvent(StartEvent):
@@ -38,6 +38,7 @@ class ExtractionFinishedEvent(Event):
     category: DocumentCategory | None = None
     data: Dict[str, Any] | str | None = None
     result: ProcessingResult | None = None
+    cached: bool = False  # True when the stored extraction was reused, i.e. the document did not change
 
 
 class ReconcileInvoiceEvent(Event):
@@ -45,6 +46,13 @@ class ReconcileInvoiceEvent(Event):
     filename: str
     classification: DocumentClassification
     invoice_data: InvoiceData
+    # Decided by the rule-based engine for all pending invoices at once (matched_contract_id, notes, discrepancies)
+    rules_decision: Tuple[str, str, List[Discrepancy]] | None = None
+
+
+class ReconcileBatchEvent(Event):
+    """A group of invoices reconciled together, sharing one contract listing per LLM call."""
+    invoices: List[ReconcileInvoiceEvent]
 
 
 class ProcessingCompleteEvent(Event):
@@ -1,24 +1,32 @@
+import asyncio
+import json
 import logging
+import struct
 
 from fastapi import WebSocket
 from starlette.websockets import WebSocketDisconnect
 
+from app.extraction.cache import FileCache
 from app.extraction.events import StatusEvent, ProcessingCompleteEvent
 from app.db import sessionmanager
 from app.extraction.utils import WebSocketConnectionManager
 from app.extraction.workflow import DocumentAutomationWorkflow
 from app.extraction.services.storage import StorageService
-from app.extraction.services.ingestion import IngestionService
+from app.extraction.services.ingestion import IngestionService, ChunkedUpload
 from app.templating import templates
 
 logger = logging.getLogger(__name__)
 
+# Binary upload frames: big-endian uint32 upload_id + uint64 byte offset, followed by the chunk payload
+CHUNK_HEADER = struct.Struct(">IQ")
+
 
 class ExtractionWebSocketHandler:
     def __init__(self, websocket: WebSocket):
         self.ws_manager = WebSocketConnectionManager(websocket)
         self.storage = StorageService()
         self.ingestion = IngestionService()
+        self.uploads: dict[int, ChunkedUpload] = {}
 
     async def listen(self):
         try:
@@ -26,9 +34,16 @@ class ExtractionWebSocketHandler:
             logger.info("WebSocket handler initialized, starting loop")
 
             while True:
-                data = await self.ws_manager.websocket.receive_json()
-                if data.get("type") == "upload":
-                    await self._handle_upload(data)
+                frame = await self.ws_manager.receive()
+                if isinstance(frame, bytes):
+                    await self._handle_upload_chunk(frame)
+                    continue
+
+                data = json.loads(frame)
+                if data.get("type") == "upload_start":
+                    await self._handle_upload_start(data)
+                elif data.get("type") == "upload_finish":
+                    await self._handle_upload_finish(data)
                 elif data.get("type") == "start_batch":
                     await self._handle_start_batch(data)
                 elif data.get("type") == "retry_match":
@@ -42,28 +57,71 @@ class ExtractionWebSocketHandler:
             logger.info("WebSocket disconnected")
         except Exception as e:
             logger.error(f"WebSocket error: {e}", exc_info=True)
+        finally:
+            for upload in self.uploads.values():
+                upload.close()
+            self.uploads.clear()
 
-    async def _handle_upload(self, data: dict):
+    async def _handle_upload_start(self, data: dict):
+        upload_id = data.get("upload_id")
         filename = data.get("filename")
-        content_b64 = data.get("content")
-
-        if filename and content_b64:
-            logger.info(f"Received file upload via WebSocket: {filename}")
-
-            try:
-                async with sessionmanager.session() as db:
-                    file_id = await self.ingestion.upload_from_base64(filename, content_b64)
-                    await self.storage.get_or_create_document(db, file_id, filename)
-                
-                await self._broadcast_list_update()
-
-            except Exception as e:
-                logger.error(f"Error processing upload: {e}", exc_info=True)
-                error_html = templates.get_template("extraction/partials/upload_error.html").render(
-                    filename=filename,
-                    error=str(e)
-                )
-                await self.ws_manager.send_text(error_html)
+        size = data.get("size")
+
+        if upload_id is None or not filename or size is None:
+            raise ValueError("Invalid upload_start received")
+
+        logger.info(f"Receiving file upload via WebSocket: {filename} ({size} bytes)")
+        self.uploads[upload_id] = self.ingestion.start_upload(filename, size)
+
+    async def _handle_upload_chunk(self, frame: bytes):
+        if len(frame) < CHUNK_HEADER.size:
+            logger.error(f"Ignoring a {len(frame)} byte upload frame, shorter than its header")
+            await self._send_upload_error("unknown file", "Malformed upload chunk received")
+            return
+
+        upload_id, offset = CHUNK_HEADER.unpack_from(frame)
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload.error:
+            return
+
+        try:
+            await asyncio.to_thread(upload.write, offset, frame[CHUNK_HEADER.size:])
+        except ValueError as e:
+            # Reported to the client when the upload finishes
+            logger.error(f"Aborting upload of {upload.filename}: {e}")
+            upload.error = str(e)
+
+    async def _handle_upload_finish(self, data: dict):
+        upload = self.uploads.pop(data.get("upload_id"), None)
+        if upload is None:
+            raise ValueError("Invalid upload_finish received")
+
+        try:
+            async with sessionmanager.session() as db:
+                upload.finish()
+                if existing := await self.storage.get_doc_by_content_hash(db, upload.content_hash):
+                    # Same bytes as a known document: alias it instead of uploading and processing it again
+                    logger.info(f"{upload.filename} is a duplicate of {existing.filename}")
+                    if existing.filename != upload.filename:
+                        await self.storage.add_alias(db, upload.filename, existing.id)
+                else:
+                    file_id = await self.ingestion.upload_chunked(upload)
+                    await self.storage.get_or_create_document(db, file_id, upload.filename, upload.content_hash)
+
+            await self._broadcast_list_update()
+
+        except Exception as e:
+            logger.error(f"Error processing upload: {e}", exc_info=True)
+            await self._send_upload_error(upload.filename, str(e))
+        finally:
+            upload.close()
+
+    async def _send_upload_error(self, filename: str, error: str):
+        error_html = templates.get_template("extraction/partials/upload_error.html").render(
+            filename=filename,
+            error=error
+        )
+        await self.ws_manager.send_text(error_html)
 
     async def _handle_start_batch(self, data: dict):
         filenames = data.get("filenames", [])
@@ -97,8 +155,7 @@ class ExtractionWebSocketHandler:
         logger.info("Retrying all incomplete items")
         async with sessionmanager.session() as db:
             file_ids = await self.storage.get_incomplete_file_ids(db)
-            for fid in file_ids:
-                await self.storage.update_doc(db, fid, reconciliation_notes=None, discrepancies=None)
+            await self.storage.update_docs(db, file_ids, reconciliation_notes=None, discrepancies=None)
 
         if file_ids:
             logger.info(f"Triggering workflow with {len(file_ids)} incomplete files")
@@ -109,13 +166,15 @@ class ExtractionWebSocketHandler:
         try:
             await self._broadcast_controls(running=True)
             logger.info(f"Starting workflow for files: {file_ids}")
-            handler = workflow.run(file_ids=file_ids)
+            # Downloaded files stay cached until classify and extract have read them
+            with FileCache.in_use(file_ids):
+                handler = workflow.run(file_ids=file_ids)
 
-            async for event in handler.stream_events():
-                if isinstance(event, StatusEvent):
-                    await self._handle_status_event(event)
+                async for event in handler.stream_events():
+                    if isinstance(event, StatusEvent):
+                        await self._handle_status_event(event)
 
-            await handler
+                await handler
             logger.info(f"Workflow completed successfully.")
             await self._handle_completion_event()
 
@@ -49,8 +49,11 @@ For EACH invoice provided above:
 2. Identify discrepancies (Payment terms, Total amounts, Vendor names).
 3. Assess match confidence.
 
+IMPORTANT:
+If a match is found, you MUST provide the 'matched_contract_index' corresponding to the position of the contract in the "Available Contracts" list (0-based).
+
 Output Format:
-Return a JSON object where keys are the filenames of the invoices and values are the reconciliation results.
+Return a JSON object where keys are the exact filenames of the invoices (as given after "Invoice File:") and values are the reconciliation results.
 
 Example structure:
 {
@@ -0,0 +1,168 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import random
+import time
+from typing import AsyncIterator
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+RATE_LIMIT_BASE_DELAY = float(os.getenv("RATE_LIMIT_BASE_DELAY", "1.0"))
+RATE_LIMIT_MAX_DELAY = float(os.getenv("RATE_LIMIT_MAX_DELAY", "60.0"))
+
+# provider -> (requests per second, max concurrent requests), overridable via <PROVIDER>_RATE_PER_SECOND / <PROVIDER>_MAX_CONCURRENCY
+_PROVIDER_DEFAULTS = {
+    "llama_cloud": (10.0, 16),
+    "llama_sheets": (5.0, 8),
+    "openai": (8.0, 16),
+}
+
+# A server error may come after the request took effect, only these can be sent again safely (RFC 9110, 9.2.2)
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"}
+# provider -> path suffixes of POST endpoints that are safe to send again: completions are stateless,
+# a repeated parse upload at worst starts a second job whose result is never read
+SAFE_POST_PATHS = {
+    "llama_cloud": ("/parsing/upload",),
+    "llama_sheets": ("/sheets/jobs",),
+    "openai": ("/chat/completions", "/completions", "/responses", "/embeddings"),
+}
+# Raised before the request reached the provider, so it can always be sent again
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class ProviderLimiter:
+    """
+    Process-wide limiter for one external provider, shared by every workflow run.
+    A token bucket caps the request rate and an AIMD window caps the number of requests in flight:
+    the window grows by one per window's worth of successes and halves on throttling (429), server errors (5xx)
+    or failed connections.
+    """
+
+    def __init__(self, name: str, rate_per_second: float, max_concurrency: int, min_concurrency: int = 1):
+        self.name = name
+        self.rate_per_second = rate_per_second
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+
+        self._tokens = rate_per_second
+        self._refilled_at = time.monotonic()
+        self._bucket_lock = asyncio.Lock()
+        self._window = asyncio.Condition()
+
+    async def _take_token(self) -> None:
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate_per_second, self._tokens + (now - self._refilled_at) * self.rate_per_second)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate_per_second)
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Waits for a concurrency slot and a rate token, holding the slot for the duration of the block."""
+        async with self._window:
+            await self._window.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+        try:
+            await self._take_token()
+            yield
+        finally:
+            async with self._window:
+                self.in_flight -= 1
+                self._window.notify_all()
+
+    def on_success(self) -> None:
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def on_throttled(self) -> None:
+        previous = int(self.concurrency)
+        self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+        if int(self.concurrency) != previous:
+            logger.warning(f"{self.name} is throttling, concurrency reduced to {int(self.concurrency)}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_limiter(provider: str) -> ProviderLimiter:
+    rate_per_second, max_concurrency = _PROVIDER_DEFAULTS[provider]
+    prefix = provider.upper()
+    return ProviderLimiter(
+        provider,
+        rate_per_second=float(os.getenv(f"{prefix}_RATE_PER_SECOND", rate_per_second)),
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", max_concurrency)),
+    )
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that sends every request through a ProviderLimiter and retries with exponential backoff and jitter,
+    honouring Retry-After when the provider sends it: 429 responses always, 5xx responses and transport errors
+    (connection resets, timeouts) when the request can be replayed, i.e. it is idempotent or a POST to one of
+    `safe_post_paths`. It is the only retry layer: clients using it are created with their SDK's own retries disabled.
+    """
+
+    def __init__(
+        self, limiter: ProviderLimiter, transport: httpx.AsyncBaseTransport = None, max_retries: int = RATE_LIMIT_MAX_RETRIES,
+        safe_post_paths: tuple[str, ...] = (),
+    ):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.safe_post_paths = safe_post_paths
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    def _replayable(self, request: httpx.Request) -> bool:
+        """Whether a request that may already have taken effect can be sent again."""
+        if request.method in _IDEMPOTENT_METHODS:
+            return True
+        return request.method == "POST" and request.url.path.endswith(self.safe_post_paths)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # JSON and multipart bodies (everything the SDKs send) can be replayed, multipart files are re-read from the start
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.limiter.slot():
+                    response = await self._transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                self.limiter.on_throttled()
+                if not (isinstance(e, _NOT_SENT_ERRORS) or self._replayable(request)) or attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.info(f"{self.limiter.name} request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code != 429 and response.status_code < 500:
+                self.limiter.on_success()
+                return response
+
+            self.limiter.on_throttled()
+            # A 429 was rejected before doing anything; a 5xx may come after the request took effect
+            retryable = response.status_code == 429 or self._replayable(request)
+            if not retryable or attempt == self.max_retries:
+                return response
+
+            delay = self._retry_delay(attempt, response)
+            logger.info(f"{self.limiter.name} answered {response.status_code}, retrying in {delay:.1f}s")
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retry_delay(attempt: int, response: httpx.Response | None = None) -> float:
+        try:
+            retry_after = float(response.headers.get("retry-after", "")) if response is not None else 0.0
+        except ValueError:
+            retry_after = 0.0
+        backoff = RATE_LIMIT_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1.5)
+        return min(RATE_LIMIT_MAX_DELAY, max(retry_after, backoff))
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -10,12 +10,31 @@ class DocumentCategory(str, Enum):
     OTHER = "other"
 
 
+class ProcessingStatus(str, Enum):
+    PROCESSING = "processing"
+    EXTRACTED = "extracted"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+
+
 class CacheField(str, Enum):
     EXTRACTED_DATA = "extracted_data"
     TEXT_CONTENT = "text_content"
     RECONCILIATION_NOTES = "reconciliation_notes"
 
 
+class ParseSource(str, Enum):
+    TEXT_LAYER = "text_layer"
+    LLAMAPARSE = "llamaparse"
+    LOCAL_SPREADSHEET = "local_spreadsheet"
+    LLAMASHEETS = "llamasheets"
+
+
+class ReconciliationEngine(str, Enum):
+    RULES = "rules"
+    LLM = "llm"
+
+
 class DocumentClassification(BaseModel):
     """Result of document classification"""
 
@@ -41,6 +60,14 @@ class Discrepancy(BaseModel):
     issue: str
 
 
+class ArithmeticIssue(BaseModel):
+    """An invoice amount that doesn't agree with the invoice's own line items, independent of any contract"""
+    field: str
+    invoice_value: str
+    expected_value: str
+    issue: str
+
+
 class InvoiceData(BaseModel):
     """Structured data extracted from an invoice"""
     model_config = ConfigDict(extra="forbid")
@@ -48,6 +75,7 @@ class InvoiceData(BaseModel):
     vendor_name: str | None = None
     invoice_number: str | None = None
     total_amount: float | None = None
+    subtotal: float | None = Field(default=None, description="Amount before tax, shipping and other charges, if printed")
     date: str | None = None
     purchase_order_number: str | None = None
     payment_terms: str | None = None
@@ -63,6 +91,25 @@ class ContractData(BaseModel):
     payment_terms: str | None = None
 
 
+class PaymentTerms(BaseModel):
+    """Structured form of free-text payment terms"""
+
+    net_days: int | None = None
+    discount_percent: float | None = None
+    discount_days: int | None = None
+    due_on_receipt: bool = False
+    end_of_month: bool = False
+
+
+class ExtractionOutput(BaseModel):
+    """What the extraction of a single document produced"""
+
+    extracted_data: dict[str, Any]
+    text_content: str | None = None  # Only kept for contracts, they are the reconciliation context
+    parse_source: ParseSource | None = None
+    payment_terms: PaymentTerms | None = None  # Parsed from extracted_data["payment_terms"] when recognised
+
+
 class ProcessingResult(BaseModel):
     """Final result for a processed file"""
 
@@ -72,6 +119,7 @@ class ProcessingResult(BaseModel):
     matched_contract_id: str | None = None
     extracted_data: dict[str, Any] | None = None
     reconciliation_notes: str | None = None
+    reconciliation_engine: ReconciliationEngine | None = None
     discrepancies: list[Discrepancy] = []
 
 
@@ -0,0 +1,143 @@
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from difflib import SequenceMatcher
+
+import pandas as pd
+
+from app.extraction.schemas import ContractData, InvoiceData, PaymentTerms
+from app.extraction.services.payment_terms import parse_payment_terms
+
+RECONCILIATION_TOP_K = int(os.getenv("RECONCILIATION_TOP_K", "5"))
+
+_LEGAL_SUFFIXES = {
+    "inc", "incorporated", "llc", "ltd", "limited", "corp", "corporation", "co", "company",
+    "gmbh", "ag", "sa", "sas", "srl", "bv", "nv", "plc", "pty", "lp", "llp", "the",
+}
+VENDOR_MATCH_THRESHOLD = 0.6
+# A name whose words are all part of the other ('globex' vs 'globex logistics') is the same vendor, named in short
+_CONTAINED_NAME_SIMILARITY = 0.9
+
+
+def normalize_vendor(name: str | None) -> str:
+    """Lowercase vendor name without punctuation or legal suffixes: 'ACME Corp., Inc.' -> 'acme'."""
+    if not name:
+        return ""
+    tokens = re.sub(r"[^a-z0-9]+", " ", name.lower()).split()
+    return " ".join(t for t in tokens if t not in _LEGAL_SUFFIXES)
+
+
+def normalize_identifier(value: str | None) -> str:
+    """Uppercase alphanumerics only: 'po-2024/0017' -> 'PO20240017'."""
+    if not value:
+        return ""
+    return re.sub(r"[^A-Z0-9]", "", value.upper())
+
+
+def vendor_similarity(a: str, b: str) -> float:
+    """Similarity of two normalized vendor names in [0, 1] (token overlap, token containment or character similarity)."""
+    if not a or not b:
+        return 0.0
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    jaccard = len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+    contained = _CONTAINED_NAME_SIMILARITY if tokens_a <= tokens_b or tokens_b <= tokens_a else 0.0
+    return max(jaccard, contained, SequenceMatcher(None, a, b).ratio())
+
+
+def parse_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    parsed = pd.to_datetime(value, errors="coerce")
+    return None if pd.isna(parsed) else parsed.to_pydatetime().replace(tzinfo=None)
+
+
+@dataclass
+class ContractKeys:
+    """Normalized matching keys of one contract."""
+    contract: dict
+    vendor: str
+    number: str
+    effective: datetime | None
+    expiration: datetime | None
+    payment_terms: str | None = None
+    terms: PaymentTerms | None = None
+
+    @property
+    def is_indexed(self) -> bool:
+        return bool(self.vendor or self.number)
+
+    def number_matches(self, references: set[str]) -> bool:
+        """Whether the contract number is one of (or, when long enough to be distinctive, part of) the invoice references."""
+        return bool(self.number) and any(
+            self.number == ref or (len(self.number) >= 4 and self.number in ref) for ref in references
+        )
+
+    def covers(self, invoice_date: datetime) -> bool:
+        return not ((self.effective and invoice_date < self.effective) or (self.expiration and invoice_date > self.expiration))
+
+
+def invoice_references(invoice: InvoiceData) -> set[str]:
+    """Normalized identifiers an invoice can use to reference its contract (PO number, invoice number)."""
+    references = {normalize_identifier(invoice.purchase_order_number), normalize_identifier(invoice.invoice_number)}
+    references.discard("")
+    return references
+
+
+class ContractCandidateIndex:
+    """
+    Local index over extracted ContractData, used to shortlist the contracts that can plausibly match an invoice
+    (vendor name, contract number referenced by the invoice, validity dates) before asking the LLM.
+    """
+
+    def __init__(self, contracts: list[dict]):
+        self.entries = []
+        for c in contracts:
+            data = ContractData(**(c.get("extracted_data") or {}))
+            self.entries.append(ContractKeys(
+                contract=c,
+                vendor=normalize_vendor(data.vendor_name),
+                number=normalize_identifier(data.contract_number),
+                effective=parse_date(data.effective_date),
+                expiration=parse_date(data.expiration_date),
+                payment_terms=data.payment_terms,
+                terms=(
+                    PaymentTerms(**c["normalized_payment_terms"]) if c.get("normalized_payment_terms")
+                    else parse_payment_terms(data.payment_terms)
+                ),
+            ))
+
+    @staticmethod
+    def score(keys: ContractKeys, invoice: InvoiceData) -> float:
+        """Plausibility of `keys` matching `invoice`; 0 means the contract can be ruled out."""
+        if not keys.is_indexed:
+            # Nothing was extracted from this contract, it can't be ruled out
+            return 0.1
+
+        score = 0.0
+        if keys.number_matches(invoice_references(invoice)):
+            score += 1.0
+
+        similarity = vendor_similarity(keys.vendor, normalize_vendor(invoice.vendor_name))
+        if similarity >= VENDOR_MATCH_THRESHOLD:
+            score += similarity
+
+        if score and (invoice_date := parse_date(invoice.date)):
+            if not keys.covers(invoice_date):
+                score -= 0.3
+            elif keys.effective or keys.expiration:
+                score += 0.2
+        return max(score, 0.0)
+
+    def shortlist(self, invoice: InvoiceData, k: int = RECONCILIATION_TOP_K, fallback: bool = True) -> list[dict]:
+        """
+        Top-`k` plausible contracts for `invoice`, best first. When none is plausible, the `k` closest by vendor name
+        are returned instead, so the LLM still gets to look; with `fallback` False the result is then empty.
+        """
+        scored = [(self.score(keys, invoice), i) for i, keys in enumerate(self.entries)]
+        ranked = [(s, i) for s, i in scored if s > 0]
+        if not ranked and fallback:
+            vendor = normalize_vendor(invoice.vendor_name)
+            ranked = [(vendor_similarity(keys.vendor, vendor), i) for i, keys in enumerate(self.entries)]
+        ranked.sort(key=lambda pair: (-pair[0], pair[1]))
+        return [self.entries[i].contract for _, i in ranked[:k]]
@@ -1,27 +1,75 @@
+import asyncio
+import logging
+import os
+import re
 from pathlib import Path
-from typing import Literal
+from typing import AsyncIterator, Literal
 from llama_cloud import ClassifierRule
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.extraction.clients import get_classifier_client
 from app.extraction.events import FileInfo
 from app.extraction.services.storage import StorageService
+from app.extraction.services.text_layer import TextLayerService
 from app.extraction.schemas import DocumentClassification, DocumentCategory
 
+logger = logging.getLogger(__name__)
+
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.6"))
+CLASSIFY_CHUNK_SIZE = int(os.getenv("CLASSIFY_CHUNK_SIZE", "20"))
+CLASSIFY_CONCURRENCY = int(os.getenv("CLASSIFY_CONCURRENCY", "4"))
+CLASSIFY_MAX_ATTEMPTS = int(os.getenv("CLASSIFY_MAX_ATTEMPTS", "3"))
+
+_LOCAL_CLASSIFIER_PAGES = 2
+_TITLE_LINES = 3
+_HEADING_LINES = 8
+_MIN_TEXT_LENGTH = 100
+# Below this the winning category has too few of its own signals to be trusted, however weak the other one is
+_MIN_CATEGORY_SCORE = 0.5
+
+# (feature, weight, pattern, scope, min matches). "title" features only look at the first lines of the first page,
+# "heading" ones at its top lines. Weights add up to 1.0 per category, the first feature (its title) is required.
+_INVOICE_FEATURES = [
+    ("invoice title", 0.3, r"^\W*((tax|commercial)\s+)?invoice\b", "title", 1),
+    ("invoice number", 0.2, r"\binvoice\s*(no\b|number|#|num\b)", "body", 1),
+    ("total due", 0.2, r"\b(total(\s+amount)?(\s+due)?|amount\s+due|balance\s+due)\b", "body", 1),
+    ("due date / bill to", 0.15, r"\b(due\s+date|payment\s+due|bill(ed)?\s+to|sold\s+to)\b", "body", 1),
+    ("money amounts", 0.15, r"(?<![\d.,])\d{1,3}(,\d{3})*\.\d{2}(?![\d.])", "body", 3),
+]
+_CONTRACT_FEATURES = [
+    ("agreement title", 0.3, r"\b(agreement|contract)\b", "heading", 1),
+    ("parties", 0.2, r"\b(by\s+and\s+between|entered\s+into)\b", "body", 1),
+    ("recitals / signatures", 0.15, r"\b(whereas|in\s+witness\s+whereof|authori[sz]ed\s+signat)", "body", 1),
+    ("term and termination", 0.15, r"\b(terminat(e|ion)|term\s+of\s+this)\b", "body", 1),
+    ("numbered clauses", 0.2, r"^\s*\d{1,2}(\.\d{1,2})*\.?\s+[A-Z]", "body", 3),
+]
+# Titles of documents that look like invoices (and mention them) but are something else, left to the remote classifier
+_OTHER_TITLES = [
+    ("credit / debit note", r"\b(credit|debit)\s+(note|memo)\b"),
+    ("statement", r"\b(statement\s+of\s+account|account\s+statement)\b|^\W*statement\b(?!\s+of\s+work)"),
+    ("purchase order", r"\bpurchase\s+order\b(?!\s*(no\b|number|#|ref))"),
+    ("quotation", r"\b(quot(e|ation)|estimate)\b(?!\s*(no\b|number|#|ref))|\bpro[\s-]?forma\b"),
+]
+
 
 class ClassificationService:
     """Service for determining document types and categories."""
 
-    def __init__(self, storage_service: StorageService = None):
+    def __init__(self, storage_service: StorageService = None, local_threshold: float = LOCAL_CLASSIFIER_THRESHOLD):
         self.storage = storage_service or StorageService()
+        self.local_threshold = local_threshold
 
-    async def classify_files(self, db: AsyncSession, files: list[FileInfo]) -> dict[str, DocumentClassification]:
-        """Classifies a batch of files using extensions or LlamaCloud Classifier."""
+    async def iter_classifications(self, db: AsyncSession, files: list[FileInfo]) -> AsyncIterator[dict[str, DocumentClassification]]:
+        """
+        Yields classifications as they become available: everything resolved locally first,
+        then one dict per remote chunk as it returns. Files of a chunk that failed are never yielded.
+        """
         results = {}
         pdfs_to_classify = []
+        cached_categories = await self.storage.get_categories(db, [f.file_id for f in files])
 
         for f in files:
             # 1. Check Cache
-            if cached := await self._check_cache(db, f):
+            if cached := self._from_cache(f, cached_categories.get(f.file_id)):
                 results[f.file_id] = cached
                 continue
 
@@ -40,30 +88,37 @@ class ClassificationService:
                 )
 
         if pdfs_to_classify:
-            llm_results = await self._classify_via_llm(pdfs_to_classify)
-            results.update(llm_results)
+            # 3. Settle obvious PDFs locally, only ambiguous ones go to the remote classifier
+            local_results = await self._classify_locally(pdfs_to_classify)
+            results.update(local_results)
+            pdfs_to_classify = [f for f in pdfs_to_classify if f.file_id not in local_results]
 
-        return results
+        yield results
 
-    async def _check_cache(self, db: AsyncSession, file_info: FileInfo) -> DocumentClassification | None:
-        if doc := await self.storage.get_doc(db, file_info.file_id):
-            if doc.category in [c.value for c in DocumentCategory]:
-                cat = DocumentCategory(doc.category)
-                file_name = file_info.filename.lower()
-                file_type: Literal["pdf", "xlsx", "unknown"] = "unknown"
-
-                if file_name.endswith(".xlsx"):
-                    file_type = "xlsx"
-                elif file_name.endswith(".pdf"):
-                    file_type = "pdf"
-                
-                return DocumentClassification(
-                    file_type=file_type,
-                    document_category=cat,
-                    confidence=1.0,
-                    summary="Retrieved from cache"
-                )
-        return None
+        if pdfs_to_classify:
+            async for chunk_results in self._classify_via_llm(pdfs_to_classify):
+                yield chunk_results
+
+    @staticmethod
+    def _from_cache(file_info: FileInfo, category: str | None) -> DocumentClassification | None:
+        """Builds a classification from a previously stored category, if it is a real one."""
+        if category not in [c.value for c in DocumentCategory]:
+            return None
+
+        file_name = file_info.filename.lower()
+        file_type: Literal["pdf", "xlsx", "unknown"] = "unknown"
+
+        if file_name.endswith(".xlsx"):
+            file_type = "xlsx"
+        elif file_name.endswith(".pdf"):
+            file_type = "pdf"
+
+        return DocumentClassification(
+            file_type=file_type,
+            document_category=DocumentCategory(category),
+            confidence=1.0,
+            summary="Retrieved from cache"
+        )
 
     @staticmethod
     def _classify_by_extension(file_info: FileInfo) -> DocumentClassification | None:
@@ -78,32 +133,125 @@ class ClassificationService:
             )
         return None
 
+    async def _classify_locally(self, files: list[FileInfo]) -> dict[str, DocumentClassification]:
+        """Classifies PDFs from their text layer, keeping only results at or above the confidence threshold."""
+        texts = await asyncio.gather(*(
+            asyncio.to_thread(TextLayerService.read_pages, f.file_path, _LOCAL_CLASSIFIER_PAGES) for f in files
+        ))
+
+        results = {}
+        for f, pages in zip(files, texts):
+            classification = self._score_text_layer(pages)
+            if classification and classification.confidence >= self.local_threshold:
+                results[f.file_id] = classification
+        return results
+
     @staticmethod
-    async def _classify_via_llm(files: list[FileInfo]) -> dict[str, DocumentClassification]:
+    def _score_text_layer(pages: list[str]) -> DocumentClassification | None:
+        """
+        Keyword and layout scoring of the first pages. Confidence is the margin between the two categories.
+        Returns None (classify remotely) when there is no clear category: the title names another kind of document,
+        or the winning category lacks its title or enough of its signals.
+        """
+        body = "\n".join(pages)
+        if len(body.strip()) < _MIN_TEXT_LENGTH:
+            return None  # Scanned or empty, nothing to go on
+
+        lines = [line for line in pages[0].splitlines() if line.strip()]
+        title = "\n".join(lines[:_TITLE_LINES])
+        scopes = {"title": title, "heading": "\n".join(lines[:_HEADING_LINES]), "body": body}
+
+        if other := [name for name, pattern in _OTHER_TITLES if re.search(pattern, title, re.IGNORECASE | re.MULTILINE)]:
+            logger.debug(f"Local pre-classifier defers a document titled as {', '.join(other)}")
+            return None
+
+        def score(features: list[tuple]) -> tuple[float, list[str]]:
+            matched = [
+                (name, weight) for name, weight, pattern, scope, min_matches in features
+                if len(re.findall(pattern, scopes[scope], re.IGNORECASE | re.MULTILINE)) >= min_matches
+            ]
+            return sum(weight for _, weight in matched), [name for name, _ in matched]
+
+        invoice_score, invoice_matched = score(_INVOICE_FEATURES)
+        contract_score, contract_matched = score(_CONTRACT_FEATURES)
+
+        category = DocumentCategory.INVOICE if invoice_score >= contract_score else DocumentCategory.CONTRACT
+        title_feature, category_score, matched = (
+            (_INVOICE_FEATURES[0][0], invoice_score, invoice_matched) if category == DocumentCategory.INVOICE
+            else (_CONTRACT_FEATURES[0][0], contract_score, contract_matched)
+        )
+        if title_feature not in matched or category_score < _MIN_CATEGORY_SCORE:
+            return None  # No clear category
+
+        return DocumentClassification(
+            file_type="pdf",
+            document_category=category,
+            confidence=round(abs(invoice_score - contract_score), 2),
+            summary="Local pre-classifier",
+            reasoning=(
+                f"invoice score {invoice_score:.2f} ({', '.join(invoice_matched) or 'no signals'}) vs "
+                f"contract score {contract_score:.2f} ({', '.join(contract_matched) or 'no signals'})"
+            ),
+        )
+
+    async def _classify_via_llm(self, files: list[FileInfo]) -> AsyncIterator[dict[str, DocumentClassification]]:
+        """Classifies files remotely in chunks of CLASSIFY_CHUNK_SIZE, at most CLASSIFY_CONCURRENCY at a time."""
+        semaphore = asyncio.Semaphore(CLASSIFY_CONCURRENCY)
+
+        async def run(chunk: list[FileInfo]) -> dict[str, DocumentClassification]:
+            async with semaphore:
+                try:
+                    return await self._classify_chunk(chunk)
+                except Exception as e:
+                    logger.error(f"Classification failed for a chunk of {len(chunk)} files: {e}")
+                    return {}
+
+        chunks = [files[i:i + CLASSIFY_CHUNK_SIZE] for i in range(0, len(files), CLASSIFY_CHUNK_SIZE)]
+        tasks = [asyncio.ensure_future(run(chunk)) for chunk in chunks]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def _classify_chunk(files: list[FileInfo]) -> dict[str, DocumentClassification]:
         classifier = get_classifier_client()
         rules = [
             ClassifierRule(type="invoice", description="Commercial document issued by seller to buyer."),
             ClassifierRule(type="contract", description="Legally binding agreement between parties."),
         ]
-        
-        cls_response = await classifier.aclassify_file_ids(
-            rules=rules,
-            file_ids=[f.file_id for f in files]
-        )
+
+        for attempt in range(1, CLASSIFY_MAX_ATTEMPTS + 1):
+            try:
+                cls_response = await classifier.aclassify_file_ids(
+                    rules=rules,
+                    file_ids=[f.file_id for f in files]
+                )
+                break
+            except Exception as e:
+                # Throttling was already retried by the rate-limited transport
+                if attempt == CLASSIFY_MAX_ATTEMPTS or getattr(e, "status_code", None) == 429:
+                    raise
+                logger.warning(f"Classification attempt {attempt} failed, retrying: {e}")
+                await asyncio.sleep(2 ** attempt)
 
         results = {}
         for item in cls_response.items:
             if (category := item.result.type) is None:
                 classification = DocumentClassification(
-                    file_type="pdf", document_category=DocumentCategory.OTHER, confidence=0.0
+                    file_type="pdf", document_category=DocumentCategory.OTHER, confidence=0.0,
+                    summary="LlamaCloud classifier"
                 )
             else:
                 classification = DocumentClassification(
                     file_type="pdf",
                     document_category=DocumentCategory(category),
                     confidence=1.0,
+                    summary="LlamaCloud classifier",
                     reasoning=item.result.reasoning
                 )
             results[item.file_id] = classification
         
-        return results
\ No newline at end of file
+        return results
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from llama_index.core.utils import get_tokenizer
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.extraction.services.candidates import ContractCandidateIndex
+from app.extraction.services.passages import CONTRACT_CONTEXT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+_CHANGED_FLAG = "contracts_changed"
+
+
+class ContractSnapshot:
+    """
+    All contracts at one version, ready for reconciliation: the rows, their candidate index (parsed ContractData)
+    and each contract's pre-rendered listing header. Treated as read-only, it is shared by every reconcile worker.
+    """
+
+    def __init__(self, version: int, contracts: list[dict]):
+        self.version = version
+        self.contracts = contracts
+        self.index = ContractCandidateIndex(contracts)
+        self.rendered = {c["id"]: f"Contract File: {c['filename']}" for c in contracts}
+        self._tokens = {}
+
+    def listing(self, contracts: list[dict], passages: dict[str, str]) -> str:
+        """
+        Numbered contract listing for a prompt, each contract shown through its `passages` (see ContractPassageIndex).
+        The LLM answers with an index into `contracts`.
+        """
+        return "\n\n".join(
+            f"[{i}] {self.rendered[c['id']]}\n{passages.get(c['id'], '(no text available)')}" for i, c in enumerate(contracts)
+        )
+
+    def tokens(self, contract_id: str) -> int:
+        """Upper bound of the token count of a contract's listing entry, computed once per snapshot."""
+        if contract_id not in self._tokens:
+            self._tokens[contract_id] = len(get_tokenizer()(self.rendered[contract_id])) + CONTRACT_CONTEXT_TOKENS
+        return self._tokens[contract_id]
+
+
+class ContractSnapshotCache:
+    """
+    Process-wide cache of the current ContractSnapshot.
+    Sessions that write a contract are flagged (`mark_changed`); when they commit the version is bumped and the next
+    reader rebuilds the snapshot. The version is read before loading, so a load racing a commit is never reused.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._snapshot: ContractSnapshot | None = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def mark_changed(db: AsyncSession) -> None:
+        db.info[_CHANGED_FLAG] = True
+
+    def invalidate(self) -> None:
+        self.version += 1
+
+    async def get(self, load: Callable[[], Awaitable[list[dict]]]) -> ContractSnapshot:
+        if (snapshot := self._snapshot) and snapshot.version == self.version:
+            return snapshot
+
+        async with self._lock:
+            if (snapshot := self._snapshot) and snapshot.version == self.version:
+                return snapshot
+            version = self.version
+            snapshot = ContractSnapshot(version, await load())
+            self._snapshot = snapshot
+            logger.info(f"Contract snapshot v{version} built with {len(snapshot.contracts)} contracts")
+            return snapshot
+
+
+contract_snapshots = ContractSnapshotCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session) -> None:
+    if session.info.pop(_CHANGED_FLAG, False):
+        contract_snapshots.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_on_rollback(session: Session) -> None:
+    session.info.pop(_CHANGED_FLAG, None)
@@ -1,29 +1,219 @@
+import asyncio
+import importlib.metadata
 import logging
+import os
+import re
+from typing import TypeVar
 from llama_index.core.prompts import PromptTemplate
+from llama_index.core.utils import get_tokenizer
+from pydantic import BaseModel
 from llama_cloud_services.beta.sheets import SpreadsheetParsingConfig
-from app.extraction.clients import get_parser, get_llm, get_sheets_client
-from app.extraction.schemas import DocumentClassification, DocumentCategory, InvoiceData, LineItem, ContractData
+from app.extraction.cache import ParseCache, file_sha256
+from app.extraction.clients import get_parser, get_structured_llm, get_sheets_client
+from app.extraction.services.payment_terms import parse_payment_terms
+from app.extraction.services.spreadsheet import SpreadsheetService
+from app.extraction.services.text_layer import TextLayerService, TEXT_LAYER_MIN_QUALITY
+from app.extraction.schemas import (
+    DocumentClassification, DocumentCategory, InvoiceData, LineItem, ContractData, ExtractionOutput, ParseSource,
+)
 
 logger = logging.getLogger(__name__)
 
+# Part of the parse cache key, so upgrading the parser invalidates earlier results
+PARSER_VERSION = importlib.metadata.version("llama-cloud-services")
+SHEETS_REGION_CONCURRENCY = int(os.getenv("SHEETS_REGION_CONCURRENCY", "8"))
+EXTRACTION_WINDOW_TOKENS = int(os.getenv("EXTRACTION_WINDOW_TOKENS", "12000"))
+EXTRACTION_WINDOW_CONCURRENCY = int(os.getenv("EXTRACTION_WINDOW_CONCURRENCY", "4"))
+
+# Appended to the extraction prompt when a long document is processed window by window
+WINDOW_NOTE = (
+    "This is part {part} of {parts} of the document. "
+    "Only extract what appears in this part and return null for every field it doesn't show.\n"
+)
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+# The |---|---| line under a markdown table's header row
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+
+
+def _split_line(line: str, max_tokens: int) -> list[str]:
+    """Cuts a line over `max_tokens` between words, or inside a word longer than the budget."""
+    tokenize = get_tokenizer()
+    pieces, current, current_tokens = [], [], 0
+    for word in line.split(" "):
+        # A token is at least one character, so pieces of size - 1 characters (plus the separator) always fit
+        size = max(1, max_tokens - 1)
+        parts = [word] if len(tokenize(word)) < size else [word[i:i + size] for i in range(0, len(word), size)]
+        for part in parts:
+            part_tokens = len(tokenize(part)) + 1
+            if current and current_tokens + part_tokens > max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _split_paragraph(paragraph: str, max_tokens: int) -> list[str]:
+    """
+    Splits a paragraph over `max_tokens` into chunks of whole lines. Markdown tables are cut between rows and every chunk
+    continuing a table starts with its header row again, so line items keep their columns. Longer lines are cut.
+    """
+    tokenize = get_tokenizer()
+    lines = paragraph.splitlines()
+    units, header = [], []  # (line, header rows of the table the line is a body row of)
+    n = 0
+    while n < len(lines):
+        line = lines[n]
+        is_row = line.lstrip().startswith("|")
+        if is_row and n + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[n + 1]):
+            # A new table: its header row and separator stay together
+            header = [line, lines[n + 1]]
+            units.append(("\n".join(header), []))
+            n += 2
+            continue
+        if not is_row:
+            header = []
+        units.append((line, header))
+        n += 1
+
+    chunks, current, current_tokens = [], [], 0
+    for line, table_header in units:
+        header_tokens = len(tokenize("\n".join(table_header))) + 1 if table_header else 0
+        if header_tokens > max_tokens // 2:
+            # Repeating a header that large would leave no room for rows
+            table_header, header_tokens = [], 0
+        line_tokens = len(tokenize(line)) + 1
+        pieces = [line] if line_tokens + header_tokens <= max_tokens else _split_line(line, max_tokens - header_tokens)
+        for piece in pieces:
+            piece_tokens = len(tokenize(piece)) + 1
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            if not current and table_header:
+                current, current_tokens = list(table_header), header_tokens
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _split_windows(text: str, max_tokens: int) -> list[str]:
+    """
+    Packs consecutive paragraphs (pages are joined by blank lines too) into windows of at most `max_tokens`.
+    Paragraphs that are too long on their own are split by line (see `_split_paragraph`).
+    """
+    tokenize = get_tokenizer()
+    if len(tokenize(text)) <= max_tokens:
+        return [text]
+
+    blocks = []
+    for paragraph in text.split("\n\n"):
+        if len(tokenize(paragraph)) <= max_tokens:
+            blocks.append(paragraph)
+        else:
+            blocks.extend(_split_paragraph(paragraph, max_tokens))
+
+    windows, current, current_tokens = [], [], 0
+    for block in blocks:
+        block_tokens = len(tokenize(block)) + 2
+        if current and current_tokens + block_tokens > max_tokens:
+            windows.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += block_tokens
+    if current:
+        windows.append("\n\n".join(current))
+    return windows
+
+
+def _merge_windows(output_cls: type[Model], parts: list[Model]) -> Model:
+    """
+    Merges per-window extractions in document order: header fields keep the first value found,
+    `line_items` are concatenated, `subtotal` and `total_amount` keep the last value (totals are printed at the end).
+    Empty strings count as not found, models answer with them for fields a window doesn't show despite the prompt.
+    """
+    def found(value) -> bool:
+        return value is not None and not (isinstance(value, str) and not value.strip())
+
+    merged = {}
+    for field in output_cls.model_fields:
+        values = [getattr(part, field) for part in parts]
+        if field == "line_items":
+            merged[field] = [item for items in values for item in items]
+        elif field in ("subtotal", "total_amount"):
+            merged[field] = next((v for v in reversed(values) if found(v)), None)
+        else:
+            merged[field] = next((v for v in values if found(v)), None)
+    return output_cls(**merged)
+
+
 class ExtractionService:
     """Service for extracting structured data or text from documents."""
 
-    async def extract(self, file_path: str, classification: DocumentClassification) -> dict | str:
+    def __init__(self, parse_cache: ParseCache = None):
+        self.parse_cache = parse_cache or ParseCache()
+
+    async def extract(self, file_path: str, classification: DocumentClassification) -> ExtractionOutput:
         """Strategy dispatcher for extraction based on classification."""
         if classification.file_type == "xlsx":
-            return await self._extract_xlsx(file_path)
-        
-        if classification.document_category == DocumentCategory.CONTRACT:
-            return await self._extract_contract(file_path)
-        
-        if classification.document_category == DocumentCategory.INVOICE:
-            return await self._extract_pdf_invoice(file_path)
-            
-        return "Unsupported document type for extraction."
+            output = await self._extract_xlsx(file_path)
+        elif classification.document_category == DocumentCategory.CONTRACT:
+            output = await self._extract_contract(file_path)
+        elif classification.document_category == DocumentCategory.INVOICE:
+            output = await self._extract_pdf_invoice(file_path)
+        else:
+            raise ValueError("Unsupported document type for extraction.")
+
+        output.payment_terms = parse_payment_terms(output.extracted_data.get("payment_terms"))
+        return output
 
-    async def _extract_xlsx(self, file_path: str) -> dict:
-        """Extracts invoice data from Excel using LlamaSheets + LLM."""
+    async def _extract_xlsx(self, file_path: str) -> ExtractionOutput:
+        """Extracts invoice data from Excel, reading simple workbooks locally and the rest via LlamaSheets, then LLM."""
+        parse_source = ParseSource.LOCAL_SPREADSHEET
+        full_text = await asyncio.to_thread(SpreadsheetService.read_simple_workbook, file_path)
+        if full_text is None:
+            parse_source = ParseSource.LLAMASHEETS
+            full_text = await self._read_xlsx_via_llamasheets(file_path)
+
+        if not full_text:
+            raise ValueError("Failed to retrieve spreadsheet data.")
+
+        invoice_data = await self._predict(
+            InvoiceData, "Extract invoice data from the following spreadsheet content:\n{text}\n", full_text
+        )
+        return ExtractionOutput(extracted_data=invoice_data.model_dump(), parse_source=parse_source)
+
+    @staticmethod
+    async def _predict(output_cls: type[Model], prompt: str, full_text: str) -> Model:
+        """
+        Structured prediction over `full_text`. Documents above EXTRACTION_WINDOW_TOKENS are split into windows
+        that are extracted concurrently and merged, so per-call latency stays flat regardless of document size.
+        """
+        llm = get_structured_llm()
+        windows = _split_windows(full_text, EXTRACTION_WINDOW_TOKENS)
+        if len(windows) == 1:
+            return await llm.astructured_predict(output_cls, PromptTemplate(prompt), text=full_text)
+
+        semaphore = asyncio.Semaphore(EXTRACTION_WINDOW_CONCURRENCY)
+        window_prompt = PromptTemplate(WINDOW_NOTE + prompt)
+
+        async def predict_window(part: int, text: str) -> Model:
+            async with semaphore:
+                return await llm.astructured_predict(output_cls, window_prompt, part=part, parts=len(windows), text=text)
+
+        logger.info(f"Extracting {output_cls.__name__} from {len(windows)} windows")
+        parts = await asyncio.gather(*(predict_window(i, text) for i, text in enumerate(windows, start=1)))
+        return _merge_windows(output_cls, parts)
+
+    @staticmethod
+    async def _read_xlsx_via_llamasheets(file_path: str) -> str:
+        """Renders every region LlamaSheets detects in the workbook, downloading regions concurrently."""
         client = get_sheets_client()
         file_response = await client.aupload_file(file_path)
         
@@ -31,59 +221,61 @@ class ExtractionService:
         job = await client.acreate_job(file_id=file_response.id, config=config)
         job_result = await client.await_for_completion(job_id=job.id)
 
-        content_parts = []
-        if job_result.regions:
-            for region in job_result.regions:
+        semaphore = asyncio.Semaphore(SHEETS_REGION_CONCURRENCY)
+
+        async def render_region(region) -> str | None:
+            async with semaphore:
                 try:
                     df = await client.adownload_region_as_dataframe(
                         job_id=job.id,
                         region_id=region.region_id
                     )
                     if not df.empty:
-                        content_parts.append(f"--- Region ({region.region_type}) ---\n{df.to_string(index=False)}")
+                        return f"--- Region ({region.region_type}) ---\n{df.to_string(index=False)}"
                 except Exception as e:
                     logger.error(f"Failed to download region {region.region_id} for job {job.id}: {e}")
-                    continue
-
-        full_text = "\n\n".join(content_parts)
-        if not full_text:
-            raise ValueError("Failed to retrieve spreadsheet data.")
+                return None
 
-        prompt = PromptTemplate("Extract invoice data from the following spreadsheet content:\n{text}\n")
-        llm = get_llm()
+        # gather keeps the region order of the job result
+        content_parts = await asyncio.gather(*(render_region(region) for region in job_result.regions or []))
+        return "\n\n".join([part for part in content_parts if part])
 
-        invoice_data = await llm.astructured_predict(
-            InvoiceData, prompt, text=full_text
-        )
-        return invoice_data.model_dump()
+    async def _parse_text(self, file_path: str) -> tuple[str, ParseSource]:
+        """
+        Parses document to raw text. A good embedded text layer is used as is;
+        scanned or low-quality PDFs go to LlamaParse, reusing the cached result for identical content.
+        """
+        pages = await asyncio.to_thread(TextLayerService.read_pages, file_path)
+        if TextLayerService.score(pages) >= TEXT_LAYER_MIN_QUALITY:
+            return "\n\n".join(pages), ParseSource.TEXT_LAYER
 
-    @staticmethod
-    async def _parse_text(file_path: str) -> str:
-        """Parses document to raw text using LlamaParse."""
         parser = get_parser()
+        content_hash = await asyncio.to_thread(file_sha256, file_path)
+        cache_key = self.parse_cache.key(content_hash, parser.result_type.value, PARSER_VERSION)
+        if (cached := await asyncio.to_thread(self.parse_cache.get, cache_key)) is not None:
+            return cached, ParseSource.LLAMAPARSE
+
         documents = await parser.aload_data(file_path)
-        return "\n\n".join([d.text for d in documents])
+        full_text = "\n\n".join([d.text for d in documents])
+        await asyncio.to_thread(self.parse_cache.set, cache_key, full_text)
+        return full_text, ParseSource.LLAMAPARSE
 
-    async def _extract_contract(self, file_path: str) -> dict:
+    async def _extract_contract(self, file_path: str) -> ExtractionOutput:
         """Extracts text AND structured data from a contract."""
-        full_text = await self._parse_text(file_path)
-        
-        prompt = PromptTemplate("Extract key contract details from the following text:\n{text}\n")
-        llm = get_llm()
+        full_text, parse_source = await self._parse_text(file_path)
         
-        contract_data = await llm.astructured_predict(
-            ContractData, prompt, text=full_text
+        contract_data = await self._predict(
+            ContractData, "Extract key contract details from the following text:\n{text}\n", full_text
+        )
+        return ExtractionOutput(
+            extracted_data=contract_data.model_dump(), text_content=full_text, parse_source=parse_source
         )
-        return {"text_content": full_text, "extracted_data": contract_data.model_dump()}
 
-    async def _extract_pdf_invoice(self, file_path: str) -> dict:
+    async def _extract_pdf_invoice(self, file_path: str) -> ExtractionOutput:
         """Extracts structured invoice data from PDF using LLM."""
-        full_text = await self._parse_text(file_path)
-        
-        prompt = PromptTemplate("Extract invoice data from the following text:\n{text}\n")
-        llm = get_llm()
+        full_text, parse_source = await self._parse_text(file_path)
         
-        invoice_data = await llm.astructured_predict(
-            InvoiceData, prompt, text=full_text
+        invoice_data = await self._predict(
+            InvoiceData, "Extract invoice data from the following text:\n{text}\n", full_text
         )
-        return invoice_data.model_dump()
\ No newline at end of file
+        return ExtractionOutput(extracted_data=invoice_data.model_dump(), parse_source=parse_source)
\ No newline at end of file
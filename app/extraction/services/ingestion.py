@@ -1,49 +1,86 @@
-import base64
-import os
+import asyncio
+import hashlib
 import tempfile
-import uuid
+from app.extraction.cache import FileCache
 from app.extraction.clients import get_llama_cloud_client, get_httpx_client
 from app.extraction.events import FileInfo
 
 
+class ChunkedUpload:
+    """
+    A file received over the WebSocket in ordered chunks.
+    Chunks are spooled to an anonymous temp file as they arrive, so only one chunk is ever held in memory.
+    """
+
+    def __init__(self, filename: str, size: int):
+        self.filename = filename
+        self.size = size
+        self.received = 0
+        self.error: str | None = None
+        self.file = tempfile.TemporaryFile()
+        self._digest = hashlib.sha256()
+
+    def write(self, offset: int, data: bytes) -> None:
+        if offset != self.received:
+            raise ValueError(f"Out of order chunk for {self.filename}: expected offset {self.received}, got {offset}")
+        if self.received + len(data) > self.size:
+            raise ValueError(f"Upload of {self.filename} exceeds its declared size of {self.size} bytes")
+        self.file.write(data)
+        self._digest.update(data)
+        self.received += len(data)
+
+    def finish(self) -> None:
+        if self.error:
+            raise ValueError(self.error)
+        if self.received != self.size:
+            raise ValueError(f"Upload of {self.filename} is incomplete: {self.received}/{self.size} bytes received")
+        self.file.seek(0)
+
+    @property
+    def content_hash(self) -> str:
+        """Hex sha256 of the bytes received so far."""
+        return self._digest.hexdigest()
+
+    def close(self) -> None:
+        self.file.close()
+
+
 class IngestionService:
     """Service for handling file downloads and local storage."""
 
-    @staticmethod
-    async def download_file(file_id: str) -> FileInfo:
-        """Downloads a file from LlamaCloud to a temporary local path."""
+    def __init__(self, file_cache: FileCache = None):
+        self.file_cache = file_cache or FileCache()
+
+    async def download_file(self, file_id: str) -> FileInfo:
+        """Returns a local copy of a LlamaCloud file, downloading it only when it is not already cached."""
+        if cached := await asyncio.to_thread(self.file_cache.get, file_id):
+            return FileInfo(file_id=file_id, file_path=cached.path, filename=cached.filename)
+
         client = get_llama_cloud_client()
         
         # Fetch metadata and download URL
         file_meta = await client.files.get_file(file_id)
         content_url = await client.files.read_file_content(file_id)
 
-        # Stream to temp file
-        temp_dir = tempfile.gettempdir()
-        file_path = str(os.path.join(temp_dir, file_meta.name))
-
+        # Stream into the cache
         httpx_client = get_httpx_client()
         async with httpx_client.stream("GET", content_url.url) as response:
-            with open(file_path, "wb") as f:
-                async for chunk in response.aiter_bytes():
-                    f.write(chunk)
+            response.raise_for_status()
+            cached = await self.file_cache.store(
+                file_id, file_meta.name, response.aiter_bytes(), expected_size=file_meta.file_size
+            )
 
-        return FileInfo(file_id=file_id, file_path=file_path, filename=file_meta.name)
+        return FileInfo(file_id=file_id, file_path=cached.path, filename=cached.filename)
 
     @staticmethod
-    async def upload_from_base64(filename: str, content_b64: str) -> str:
-        """Handles a base64 upload, saves to temp, uploads to LlamaCloud, returns file_id."""
-        temp_path = f"/tmp/{uuid.uuid4()}_{filename}"
-        try:
-            file_bytes = base64.b64decode(content_b64)
-            with open(temp_path, "wb") as f:
-                f.write(file_bytes)
-
-            client = get_llama_cloud_client()
-            with open(temp_path, "rb") as f:
-                llama_file = await client.files.upload_file(upload_file=(filename, f))
-            
-            return llama_file.id
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+    def start_upload(filename: str, size: int) -> ChunkedUpload:
+        """Opens a spool for a file that will arrive in ordered chunks."""
+        return ChunkedUpload(filename, size)
+
+    @staticmethod
+    async def upload_chunked(upload: ChunkedUpload) -> str:
+        """Uploads a completed chunked upload to LlamaCloud straight from its spool file, returns file_id."""
+        upload.finish()
+        client = get_llama_cloud_client()
+        llama_file = await client.files.upload_file(upload_file=(upload.filename, upload.file))
+        return llama_file.id
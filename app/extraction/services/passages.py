@@ -0,0 +1,216 @@
+import functools
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from llama_index.core.utils import get_tokenizer
+from sqlalchemy.engine import make_url
+
+from app.db import DATABASE_URL
+from app.extraction.cache import CACHE_ROOT
+
+
+def _default_index_path(database_url: str) -> str:
+    """
+    One index per application database, so databases never share (stale) passages: next to a SQLite file
+    (./app.db -> ./app.contract_index.sqlite), otherwise under CACHE_ROOT keyed by the database URL.
+    """
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        database = Path(url.database)
+        return str(database.with_name(f"{database.stem}.contract_index.sqlite"))
+    key = hashlib.sha256(url.render_as_string(hide_password=True).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_ROOT, f"contract_index-{key}.sqlite")
+
+
+CONTRACT_INDEX_PATH = os.getenv("CONTRACT_INDEX_PATH") or _default_index_path(DATABASE_URL)
+CONTRACT_PASSAGE_TOKENS = int(os.getenv("CONTRACT_PASSAGE_TOKENS", "200"))
+CONTRACT_CONTEXT_TOKENS = int(os.getenv("CONTRACT_CONTEXT_TOKENS", "600"))
+
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+_TERM = re.compile(r"[a-z0-9]+")
+# Added to every query: the passages where payment terms and validity dates are usually written
+QUERY_HINTS = "payment terms net days due invoice purchase order effective expiration term"
+
+
+def terms(text: str) -> list[str]:
+    return _TERM.findall(text.lower())
+
+
+def split_passages(text: str, max_tokens: int = CONTRACT_PASSAGE_TOKENS) -> list[tuple[str, int]]:
+    """
+    Packs consecutive paragraphs into passages of at most `max_tokens`, returning `(passage, tokens)` pairs.
+    Paragraphs that are too long on their own are split by line, then by word.
+    """
+    tokenize = get_tokenizer()
+    blocks = []
+    for paragraph in text.split("\n\n"):
+        if not paragraph.strip():
+            continue
+        if len(tokenize(paragraph)) <= max_tokens:
+            blocks.append(paragraph)
+            continue
+        for line in paragraph.splitlines():
+            words = line.split()
+            # A token is about 3/4 of a word, so max_tokens / 2 words always fits
+            for i in range(0, len(words), max(1, max_tokens // 2)):
+                blocks.append(" ".join(words[i:i + max(1, max_tokens // 2)]))
+
+    passages, current, current_tokens = [], [], 0
+    for block in blocks:
+        block_tokens = len(tokenize(block)) + 2
+        if current and current_tokens + block_tokens > max_tokens:
+            passages.append(("\n\n".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += block_tokens
+    if current:
+        passages.append(("\n\n".join(current), current_tokens))
+    return passages
+
+
+class ContractPassageIndex:
+    """
+    BM25 inverted index over passages of contract text, persisted in a standalone SQLite file.
+    Contracts are (re)indexed one at a time when their text changes, so the index grows as contracts are extracted.
+    """
+
+    def __init__(self, path: str | Path = None):
+        path = Path(path or CONTRACT_INDEX_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS documents (document_id TEXT PRIMARY KEY, text_hash TEXT NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS passages "
+                "(id INTEGER PRIMARY KEY, document_id TEXT NOT NULL, position INTEGER NOT NULL, "
+                "text TEXT NOT NULL, tokens INTEGER NOT NULL, length INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_passages_document_id ON passages (document_id)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, passage_id INTEGER NOT NULL, tf INTEGER NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_postings_term ON postings (term)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_postings_passage_id ON postings (passage_id)")
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _remove(self, document_id: str) -> None:
+        self._conn.execute(
+            "DELETE FROM postings WHERE passage_id IN (SELECT id FROM passages WHERE document_id = ?)", (document_id,)
+        )
+        self._conn.execute("DELETE FROM passages WHERE document_id = ?", (document_id,))
+        self._conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+
+    def add(self, document_id: str, text: str | None) -> None:
+        """Indexes the passages of a contract, replacing earlier ones. No-op when the text is unchanged."""
+        text = text or ""
+        text_hash = self._hash(text)
+        with self._lock:
+            row = self._conn.execute("SELECT text_hash FROM documents WHERE document_id = ?", (document_id,)).fetchone()
+            if row and row[0] == text_hash:
+                return
+
+        # Tokenizing is the slow part, keep it outside the lock
+        passages = split_passages(text)
+        with self._lock, self._conn:
+            self._remove(document_id)
+            self._conn.execute("INSERT INTO documents (document_id, text_hash) VALUES (?, ?)", (document_id, text_hash))
+            for position, (passage, tokens) in enumerate(passages):
+                passage_terms = terms(passage)
+                cursor = self._conn.execute(
+                    "INSERT INTO passages (document_id, position, text, tokens, length) VALUES (?, ?, ?, ?, ?)",
+                    (document_id, position, passage, tokens, len(passage_terms)),
+                )
+                counts = defaultdict(int)
+                for term in passage_terms:
+                    counts[term] += 1
+                self._conn.executemany(
+                    "INSERT INTO postings (term, passage_id, tf) VALUES (?, ?, ?)",
+                    [(term, cursor.lastrowid, tf) for term, tf in counts.items()],
+                )
+
+    def sync(self, contracts: list[dict]) -> None:
+        """Indexes new or changed contracts and drops documents that are no longer contracts."""
+        for c in contracts:
+            self.add(c["id"], c["text_content"])
+
+        current = {c["id"] for c in contracts}
+        with self._lock, self._conn:
+            indexed = [row[0] for row in self._conn.execute("SELECT document_id FROM documents")]
+            for document_id in indexed:
+                if document_id not in current:
+                    self._remove(document_id)
+
+    def select(self, document_ids: list[str], query: str, budget: int = CONTRACT_CONTEXT_TOKENS) -> dict[str, str]:
+        """
+        The most relevant passages of each document for `query`, within `budget` tokens per document.
+        The opening passage (parties, object) always comes first; passages are returned in document order.
+        """
+        if not document_ids:
+            return {}
+        query_terms = sorted(set(terms(f"{query} {QUERY_HINTS}")))
+        doc_marks = ",".join("?" * len(document_ids))
+        term_marks = ",".join("?" * len(query_terms))
+
+        with self._lock:
+            count, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM passages").fetchone()
+            if not count:
+                return {}
+            df = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({term_marks}) GROUP BY term", query_terms
+            ).fetchall())
+            candidates = self._conn.execute(
+                f"SELECT id, document_id, position, tokens, length FROM passages WHERE document_id IN ({doc_marks})",
+                document_ids,
+            ).fetchall()
+            hits = self._conn.execute(
+                f"SELECT p.id, po.term, po.tf FROM postings po JOIN passages p ON p.id = po.passage_id "
+                f"WHERE p.document_id IN ({doc_marks}) AND po.term IN ({term_marks})",
+                [*document_ids, *query_terms],
+            ).fetchall()
+
+        lengths = {passage_id: length for passage_id, _, _, _, length in candidates}
+        scores = defaultdict(float)
+        for passage_id, term, tf in hits:
+            idf = math.log(1 + (count - df[term] + 0.5) / (df[term] + 0.5))
+            norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * lengths[passage_id] / (avg_length or 1))
+            scores[passage_id] += idf * tf * (_BM25_K1 + 1) / (tf + norm)
+
+        by_document = defaultdict(list)
+        for passage_id, document_id, position, tokens, _ in candidates:
+            by_document[document_id].append((passage_id, position, tokens))
+
+        chosen = {}
+        for document_id, passages in by_document.items():
+            ranked = sorted(passages, key=lambda p: (p[1] != 0, -scores[p[0]], p[1]))
+            picked, used = [], 0
+            for passage_id, position, tokens in ranked:
+                if position != 0 and scores[passage_id] <= 0:
+                    break
+                if used + tokens > budget:
+                    continue
+                picked.append((position, passage_id))
+                used += tokens
+            chosen[document_id] = [passage_id for _, passage_id in sorted(picked)]
+
+        passage_ids = [passage_id for ids in chosen.values() for passage_id in ids]
+        if not passage_ids:
+            return {}
+        with self._lock:
+            texts = dict(self._conn.execute(
+                f"SELECT id, text FROM passages WHERE id IN ({','.join('?' * len(passage_ids))})", passage_ids
+            ).fetchall())
+        return {document_id: "\n[...]\n".join(texts[i] for i in ids) for document_id, ids in chosen.items() if ids}
+
+
+@functools.lru_cache(maxsize=None)
+def get_passage_index() -> ContractPassageIndex:
+    return ContractPassageIndex()
@@ -0,0 +1,95 @@
+import re
+
+import numpy as np
+
+from app.extraction.schemas import Discrepancy, PaymentTerms
+
+# Compared field by field, with the label used in discrepancy messages
+_FIELDS = {
+    "net_days": "net days",
+    "discount_percent": "discount %",
+    "discount_days": "discount days",
+    "due_on_receipt": "due on receipt",
+    "end_of_month": "end of month",
+}
+
+_DATE = re.compile(r"\b\d{1,4}\s*[/.-]\s*\d{1,2}\s*[/.-]\s*\d{1,4}\b")
+# (percent, days) of an early payment discount: '2%/10', '2/10 net 30' (only followed by net terms), '2% 10 days'
+_DISCOUNTS = [
+    re.compile(r"\b(\d+(?:\.\d+)?)\s*%\s*/\s*(\d+)\b"),
+    re.compile(r"\b(\d+(?:\.\d+)?)\s*/\s*(\d+)(?=\s*,?\s*(?:net\b|n\s*/))"),
+    re.compile(r"\b(\d+(?:\.\d+)?)\s*%\s*(?:discount\s*)?(?:if paid\s*)?(?:within\s*)?(\d+)\s*days?\b"),
+]
+
+
+def parse_payment_terms(text: str | None) -> PaymentTerms | None:
+    """
+    Structured form of common payment terms: 'Net 30 days', '2/10 Net 30', '2% 10 days, net 30', 'Net 45 EOM', 'Due on receipt'.
+    Returns None when the terms are not in a recognised shape.
+    """
+    if not text:
+        return None
+    # Dates ('due 12/31/2024') would otherwise read as discounts or days
+    lowered = _DATE.sub(" ", text.lower())
+
+    discount_percent = discount_days = None
+    if discount := next(filter(None, (pattern.search(lowered) for pattern in _DISCOUNTS)), None):
+        discount_percent, discount_days = float(discount.group(1)), int(discount.group(2))
+        lowered = lowered[:discount.start()] + " " + lowered[discount.end():]
+    elif "%" in lowered or "discount" in lowered:
+        # Early payment discount in some other wording, don't guess
+        return None
+
+    net = re.search(r"\bnet\s*(\d+)\b", lowered) or re.search(r"\bn\s*/\s*(\d+)\b", lowered) or re.search(r"\b(\d+)\s*days?\b", lowered)
+    if not net:
+        # Only without an explicit number of days: 'net 30 days upon receipt' counts from receipt, it isn't due on it
+        if discount_percent is None and re.search(r"\b(due )?(up)?on receipt\b|\bimmediate(ly)?\b", lowered):
+            return PaymentTerms(net_days=0, due_on_receipt=True)
+        return None
+
+    return PaymentTerms(
+        net_days=int(net.group(1)),
+        discount_percent=discount_percent,
+        discount_days=discount_days,
+        end_of_month=bool(re.search(r"\beom\b|end of (the )?month", lowered)),
+    )
+
+
+def _columns(terms: list[PaymentTerms]) -> dict[str, np.ndarray]:
+    """Column arrays of `terms`, unknown numbers as NaN."""
+    return {
+        field: np.array([np.nan if getattr(t, field) is None else float(getattr(t, field)) for t in terms])
+        for field in _FIELDS
+    }
+
+
+def compare_payment_terms(
+    invoice_terms: list[PaymentTerms], contract_terms: list[PaymentTerms], invoice_texts: list[str], contract_texts: list[str],
+) -> list[Discrepancy | None]:
+    """
+    Compares many (invoice, contract) pairs of structured terms in one vectorized pass.
+    Returns, for each pair, a payment terms Discrepancy naming the differing fields, or None when the terms agree.
+    """
+    if not invoice_terms:
+        return []
+    invoice_cols, contract_cols = _columns(invoice_terms), _columns(contract_terms)
+    # NaN != NaN, so a field missing on both sides has to be treated as equal explicitly
+    differs = np.stack([
+        ~((invoice_cols[f] == contract_cols[f]) | (np.isnan(invoice_cols[f]) & np.isnan(contract_cols[f])))
+        for f in _FIELDS
+    ], axis=1)
+
+    fields = list(_FIELDS)
+    result = [None] * len(invoice_terms)
+    for i in np.flatnonzero(differs.any(axis=1)):
+        details = ", ".join(
+            f"{_FIELDS[fields[j]]} {getattr(invoice_terms[i], fields[j])} vs {getattr(contract_terms[i], fields[j])}"
+            for j in np.flatnonzero(differs[i])
+        )
+        result[i] = Discrepancy(
+            field="payment_terms",
+            invoice_value=invoice_texts[i],
+            contract_value=contract_texts[i],
+            issue=f"Payment terms differ from the contract ({details})",
+        )
+    return result
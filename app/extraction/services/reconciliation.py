@@ -1,43 +1,96 @@
+import asyncio
+import logging
+import os
+
 from llama_index.core.prompts import PromptTemplate
-from app.extraction.clients import get_llm
-from app.extraction.prompts import RECONCILIATION_PROMPT
-from app.extraction.schemas import InvoiceData, ContractMatchResult, Discrepancy
+from llama_index.core.utils import get_tokenizer
+from app.extraction.clients import get_structured_llm
+from app.extraction.prompts import RECONCILIATION_PROMPT, BATCH_RECONCILIATION_PROMPT
+from app.extraction.services.candidates import ContractCandidateIndex
+from app.extraction.services.contracts import ContractSnapshot
+from app.extraction.services.passages import get_passage_index
+from app.extraction.services.rules import RuleBasedReconciler
+from app.extraction.schemas import (
+    InvoiceData, ContractMatchResult, Discrepancy, ReconciliationEngine, InvoiceReconciliationInput, BatchContractMatchResult,
+    PaymentTerms,
+)
+
+logger = logging.getLogger(__name__)
+
+RECONCILIATION_BATCH_SIZE = int(os.getenv("RECONCILIATION_BATCH_SIZE", "10"))
+RECONCILIATION_BATCH_TOKENS = int(os.getenv("RECONCILIATION_BATCH_TOKENS", "24000"))
+
+# (matched_contract_id, notes, discrepancies, engine that decided)
+ReconciliationOutcome = tuple[str | None, str, list[Discrepancy], ReconciliationEngine]
+# (matched_contract_id, notes, discrepancies) of an invoice the rule-based engine could decide
+RuleDecision = tuple[str, str, list[Discrepancy]]
 
 
 class ReconciliationService:
     """Service for matching invoices against contracts."""
 
     @staticmethod
-    async def reconcile(invoice: InvoiceData, contracts: list[dict]) -> tuple[str | None, str, list[Discrepancy]]:
+    def _decide_locally(
+        invoice: InvoiceData, index: ContractCandidateIndex, decision: RuleDecision | None
+    ) -> tuple[ReconciliationOutcome | None, list[dict]]:
         """
-        Analyzes invoice against a list of contracts.
-        Returns: (matched_contract_id, notes, discrepancies)
+        Returns the outcome when no LLM is needed (`decision` is the rule-based one, if any),
+        otherwise the shortlisted contracts to ask it about.
         """
-        if not contracts:
-            return None, "No contracts available for matching.", []
+        if not index.entries:
+            return (None, "No contracts available for matching.", [], ReconciliationEngine.RULES), []
 
-        contracts_text_block = "\n\n".join(
-            [f"[{i}] Contract File: {c['filename']}\n{c['text_content'][:2000]}..." 
-             for i, c in enumerate(contracts)]
-        )
+        if decision:
+            return (*decision, ReconciliationEngine.RULES), []
 
-        prompt_template = PromptTemplate(RECONCILIATION_PROMPT)
-        llm = get_llm()
-        
-        match_result = await llm.astructured_predict(
-            ContractMatchResult,
-            prompt_template,
-            **{
-                "vendor_name": invoice.vendor_name or "N/A",
-                "invoice_number": invoice.invoice_number or "N/A",
-                "invoice_date": invoice.date or "N/A",
-                "po_number": invoice.purchase_order_number or "N/A",
-                "payment_terms": invoice.payment_terms or "N/A",
-                "total": invoice.total_amount or "N/A",
-                "contracts_listing": contracts_text_block,
-            },
+        return None, index.shortlist(invoice)
+
+    @staticmethod
+    def is_affected(invoice: InvoiceData, changed_contracts: ContractCandidateIndex) -> bool:
+        """Whether any of the new or re-extracted contracts could plausibly match a pending invoice."""
+        return bool(changed_contracts.entries) and bool(changed_contracts.shortlist(invoice, k=1, fallback=False))
+
+    @staticmethod
+    def _invoice_fields(invoice: InvoiceData) -> dict:
+        return {
+            "vendor_name": invoice.vendor_name or "N/A",
+            "invoice_number": invoice.invoice_number or "N/A",
+            "invoice_date": invoice.date or "N/A",
+            "po_number": invoice.purchase_order_number or "N/A",
+            "payment_terms": invoice.payment_terms or "N/A",
+            "total": invoice.total_amount or "N/A",
+        }
+
+    @classmethod
+    def _render_invoice(cls, item: InvoiceReconciliationInput) -> str:
+        fields = cls._invoice_fields(item.invoice_data)
+        return (
+            f"Invoice File: {item.filename}\n"
+            f"- Vendor: {fields['vendor_name']}\n"
+            f"- Invoice Number: {fields['invoice_number']}\n"
+            f"- Invoice Date: {fields['invoice_date']}\n"
+            f"- PO Number: {fields['po_number']}\n"
+            f"- Payment Terms: {fields['payment_terms']}\n"
+            f"- Total: {fields['total']}"
         )
 
+    @staticmethod
+    def _query(invoice: InvoiceData) -> str:
+        """What to look for in contract text: who the invoice is from, what it references and its payment terms."""
+        return " ".join(filter(None, [
+            invoice.vendor_name, invoice.purchase_order_number, invoice.invoice_number, invoice.payment_terms,
+        ]))
+
+    @classmethod
+    async def _listing(cls, snapshot: ContractSnapshot, contracts: list[dict], invoices: list[InvoiceData]) -> str:
+        """Contract listing showing, for each contract, its passages most relevant to the invoices."""
+        query = " ".join(cls._query(invoice) for invoice in invoices)
+        passages = await asyncio.to_thread(get_passage_index().select, [c["id"] for c in contracts], query)
+        return snapshot.listing(contracts, passages)
+
+    @staticmethod
+    def _to_outcome(match_result: ContractMatchResult, contracts: list[dict]) -> ReconciliationOutcome:
+        """Maps an LLM match (index into the listed `contracts`) to an outcome."""
         matched_contract_id = None
         notes = "No matching contract found."
         discrepancies = []
@@ -49,4 +102,125 @@ class ReconciliationService:
                 notes = f"Match ({match_result.match_confidence}): {match_result.match_rationale}"
                 discrepancies = match_result.discrepancies
 
-        return matched_contract_id, notes, discrepancies
\ No newline at end of file
+        return matched_contract_id, notes, discrepancies, ReconciliationEngine.LLM
+
+    @classmethod
+    async def _predict(cls, invoice: InvoiceData, contracts: list[dict], snapshot: ContractSnapshot) -> ReconciliationOutcome:
+        contracts_text_block = await cls._listing(snapshot, contracts, [invoice])
+        match_result = await get_structured_llm().astructured_predict(
+            ContractMatchResult,
+            PromptTemplate(RECONCILIATION_PROMPT),
+            **cls._invoice_fields(invoice),
+            contracts_listing=contracts_text_block,
+        )
+        return cls._to_outcome(match_result, contracts)
+
+    @staticmethod
+    def decide_with_rules(
+        invoices: list[InvoiceData], invoice_terms: list[PaymentTerms | None], snapshot: ContractSnapshot
+    ) -> list[RuleDecision | None]:
+        """
+        Rule-based decisions for many invoices (all pending invoices of a run) at once, None where the LLM is needed.
+        Their payment terms are audited against the matched contracts in a single vectorized comparison.
+        """
+        return RuleBasedReconciler.reconcile_many(invoices, snapshot.index.entries, invoice_terms)
+
+    @classmethod
+    async def reconcile_batch(
+        cls, items: list[InvoiceReconciliationInput], snapshot: ContractSnapshot, decisions: list[RuleDecision | None] | None = None,
+    ) -> dict[str, ReconciliationOutcome]:
+        """
+        Reconciles several invoices, returning their outcomes by filename.
+        `decisions` are the rule-based decisions already taken for `items` (see `decide_with_rules`), taken here when omitted.
+        Invoices the LLM has to look at are grouped (up to RECONCILIATION_BATCH_SIZE per call, within RECONCILIATION_BATCH_TOKENS)
+        so the contracts shared by a group are listed once. Invoices missing from a batch answer are retried one by one.
+        """
+        if decisions is None:
+            decisions = RuleBasedReconciler.reconcile_many([item.invoice_data for item in items], snapshot.index.entries)
+        outcomes = {}
+        pending = []
+        for item, decision in zip(items, decisions):
+            outcome, shortlist = cls._decide_locally(item.invoice_data, snapshot.index, decision)
+            if outcome:
+                outcomes[item.filename] = outcome
+            else:
+                pending.append((item, shortlist))
+
+        batches = cls._pack_batches(pending, snapshot)
+        results = await asyncio.gather(*[cls._predict_batch(batch, snapshot) for batch in batches])
+        for batch_outcomes in results:
+            outcomes.update(batch_outcomes)
+        return outcomes
+
+    @classmethod
+    def plan_batches(
+        cls, items: list[InvoiceReconciliationInput], snapshot: ContractSnapshot, decisions: list[RuleDecision | None],
+    ) -> list[list[int]]:
+        """
+        Positions of `items` grouped into reconcile batches before they are dispatched, so invoices sharing contracts
+        end up in the same batch: those the LLM has to look at are packed as in `reconcile_batch`,
+        the ones decided locally are sliced by RECONCILIATION_BATCH_SIZE.
+        """
+        positions = {item.filename: position for position, item in enumerate(items)}
+        local, pending = [], []
+        for position, (item, decision) in enumerate(zip(items, decisions)):
+            outcome, shortlist = cls._decide_locally(item.invoice_data, snapshot.index, decision)
+            if outcome:
+                local.append(position)
+            else:
+                pending.append((item, shortlist))
+
+        batches = [[positions[item.filename] for item, _ in batch] for batch in cls._pack_batches(pending, snapshot)]
+        batches.extend(local[i:i + RECONCILIATION_BATCH_SIZE] for i in range(0, len(local), RECONCILIATION_BATCH_SIZE))
+        return batches
+
+    @classmethod
+    def _pack_batches(
+        cls, pending: list[tuple[InvoiceReconciliationInput, list[dict]]], snapshot: ContractSnapshot
+    ) -> list[list[tuple[InvoiceReconciliationInput, list[dict]]]]:
+        """Greedily groups invoices, those sharing a best candidate next to each other, while the prompt fits the budget."""
+        tokenize = get_tokenizer()
+        batches, current, current_contracts, current_tokens = [], [], set(), 0
+        for item, shortlist in sorted(pending, key=lambda pair: pair[1][0]["id"] if pair[1] else ""):
+            new_contracts = {c["id"] for c in shortlist} - current_contracts
+            cost = len(tokenize(cls._render_invoice(item))) + sum(snapshot.tokens(cid) for cid in new_contracts)
+            if current and (len(current) >= RECONCILIATION_BATCH_SIZE or current_tokens + cost > RECONCILIATION_BATCH_TOKENS):
+                batches.append(current)
+                current, current_contracts, current_tokens = [], set(), 0
+                cost = len(tokenize(cls._render_invoice(item))) + sum(snapshot.tokens(c["id"]) for c in shortlist)
+            current.append((item, shortlist))
+            current_contracts |= {c["id"] for c in shortlist}
+            current_tokens += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    @classmethod
+    async def _predict_batch(
+        cls, batch: list[tuple[InvoiceReconciliationInput, list[dict]]], snapshot: ContractSnapshot
+    ) -> dict[str, ReconciliationOutcome]:
+        if len(batch) == 1:
+            item, shortlist = batch[0]
+            return {item.filename: await cls._predict(item.invoice_data, shortlist, snapshot)}
+
+        contracts = list({c["id"]: c for _, shortlist in batch for c in shortlist}.values())
+        outcomes = {}
+        try:
+            batch_result = await get_structured_llm().astructured_predict(
+                BatchContractMatchResult,
+                PromptTemplate(BATCH_RECONCILIATION_PROMPT),
+                contracts_text=await cls._listing(snapshot, contracts, [item.invoice_data for item, _ in batch]),
+                invoices_text="\n\n".join(cls._render_invoice(item) for item, _ in batch),
+            )
+            for item, _ in batch:
+                if match_result := batch_result.results.get(item.filename):
+                    outcomes[item.filename] = cls._to_outcome(match_result, contracts)
+        except Exception as e:
+            logger.warning(f"Batch reconciliation of {len(batch)} invoices failed, reconciling them one by one: {e}")
+
+        missing = [(item, shortlist) for item, shortlist in batch if item.filename not in outcomes]
+        if missing:
+            logger.info(f"{len(missing)} of {len(batch)} invoices missing from the batch answer, reconciling them one by one")
+            fallback = await asyncio.gather(*[cls._predict(item.invoice_data, shortlist, snapshot) for item, shortlist in missing])
+            outcomes.update({item.filename: outcome for (item, _), outcome in zip(missing, fallback)})
+        return outcomes
@@ -0,0 +1,130 @@
+import re
+from collections import defaultdict
+
+from app.extraction.schemas import Discrepancy, InvoiceData, PaymentTerms
+from app.extraction.services.candidates import (
+    VENDOR_MATCH_THRESHOLD,
+    ContractKeys,
+    normalize_identifier,
+    normalize_vendor,
+    parse_date,
+    vendor_similarity,
+)
+from app.extraction.services.payment_terms import (
+    compare_payment_terms,
+    parse_payment_terms,
+)
+
+
+def _normalize_text(value: str) -> str:
+    return " ".join(re.sub(r"[^a-z0-9%/]+", " ", value.lower()).split())
+
+
+class RuleBasedReconciler:
+    """
+    Deterministic reconciliation for the common case: the invoice's PO number is exactly one contract's number.
+    Both sides must name a vendor. Vendor name, date validity and (structured) payment terms are then checked locally; whenever one of them can't be decided
+    with certainty (unrecognised terms, unrelated vendor, unreadable date) the invoice is left to the LLM.
+    """
+
+    @classmethod
+    def reconcile(
+        cls, invoice: InvoiceData, entries: list[ContractKeys], invoice_terms: PaymentTerms | None = None
+    ) -> tuple[str, str, list[Discrepancy]] | None:
+        """Returns (matched_contract_id, notes, discrepancies), or None when the case is ambiguous."""
+        return cls.reconcile_many([invoice], entries, [invoice_terms])[0]
+
+    @classmethod
+    def reconcile_many(
+        cls, invoices: list[InvoiceData], entries: list[ContractKeys], invoice_terms: list[PaymentTerms | None] | None = None,
+    ) -> list[tuple[str, str, list[Discrepancy]] | None]:
+        """
+        Decides every invoice it can, None for the ambiguous ones.
+        `invoice_terms` are the stored normalized payment terms of the invoices (parsed from the text where missing).
+        Payment terms of all decided invoices are compared with their contracts in one vectorized pass.
+        """
+        by_number = defaultdict(list)
+        for keys in entries:
+            if keys.number:
+                by_number[keys.number].append(keys)
+
+        decisions = [None] * len(invoices)
+        terms_pairs = []
+        for position, invoice in enumerate(invoices):
+            # Exact identifiers only; the looser substring match of the candidate prefilter is left to the LLM
+            matches = by_number.get(normalize_identifier(invoice.purchase_order_number), [])
+            if len(matches) != 1:
+                continue
+
+            keys = matches[0]
+            contract = keys.contract["extracted_data"]
+            vendor = cls._check_vendor(invoice, keys, contract)
+            dates = cls._check_dates(invoice, keys, contract)
+            terms = cls._terms_to_compare(invoice, keys, invoice_terms[position] if invoice_terms else None)
+            if vendor is None or dates is None or terms is None:
+                continue
+
+            notes = f"Match (high): the invoice's PO number is contract number {contract.get('contract_number')}."
+            decisions[position] = (keys.contract["id"], notes, vendor + dates)
+            if terms:
+                terms_pairs.append((position, *terms, invoice.payment_terms, keys.payment_terms))
+
+        if terms_pairs:
+            positions, invoice_terms, contract_terms, invoice_texts, contract_texts = map(list, zip(*terms_pairs))
+            for position, discrepancy in zip(positions, compare_payment_terms(invoice_terms, contract_terms, invoice_texts, contract_texts)):
+                if discrepancy:
+                    decisions[position][2].append(discrepancy)
+        return decisions
+
+    @staticmethod
+    def _check_vendor(invoice: InvoiceData, keys: ContractKeys, contract: dict) -> list[Discrepancy] | None:
+        invoice_vendor = normalize_vendor(invoice.vendor_name)
+        if not invoice_vendor or not keys.vendor:
+            # Nothing to confirm the number match with
+            return None
+        if invoice_vendor == keys.vendor:
+            return []
+        if vendor_similarity(invoice_vendor, keys.vendor) < VENDOR_MATCH_THRESHOLD:
+            # An unrelated vendor makes the number match itself doubtful
+            return None
+        return [Discrepancy(
+            field="vendor_name",
+            invoice_value=invoice.vendor_name,
+            contract_value=contract.get("vendor_name"),
+            issue="Vendor name differs from the contract",
+        )]
+
+    @staticmethod
+    def _check_dates(invoice: InvoiceData, keys: ContractKeys, contract: dict) -> list[Discrepancy] | None:
+        if not invoice.date or not (keys.effective or keys.expiration):
+            return []
+        invoice_date = parse_date(invoice.date)
+        if invoice_date is None:
+            return None
+        if keys.covers(invoice_date):
+            return []
+        return [Discrepancy(
+            field="date",
+            invoice_value=invoice.date,
+            contract_value=f"{contract.get('effective_date') or '...'} to {contract.get('expiration_date') or '...'}",
+            issue="Invoice date is outside the contract validity period",
+        )]
+
+    @staticmethod
+    def _terms_to_compare(
+        invoice: InvoiceData, keys: ContractKeys, invoice_terms: PaymentTerms | None
+    ) -> tuple[PaymentTerms, PaymentTerms] | tuple | None:
+        """
+        The structured (invoice, contract) terms to compare, () when neither side states any,
+        None when they can't be verified (terms on one side only, or unrecognised).
+        """
+        if not invoice.payment_terms and not keys.payment_terms:
+            return ()
+        if not invoice.payment_terms or not keys.payment_terms:
+            return None
+        if _normalize_text(invoice.payment_terms) == _normalize_text(keys.payment_terms):
+            return ()
+        invoice_terms = invoice_terms or parse_payment_terms(invoice.payment_terms)
+        if invoice_terms is None or keys.terms is None:
+            return None
+        return invoice_terms, keys.terms
@@ -0,0 +1,98 @@
+import logging
+import os
+from typing import Any
+
+import openpyxl
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+LOCAL_XLSX_MAX_CELLS = int(os.getenv("LOCAL_XLSX_MAX_CELLS", "5000"))
+
+_MAX_SHEETS = 3
+_MAX_REGIONS = 8
+
+
+class SpreadsheetService:
+    """Service for reading simple spreadsheets locally, without LlamaSheets."""
+
+    @classmethod
+    def read_simple_workbook(cls, file_path: str) -> str | None:
+        """
+        Renders a simple workbook as `--- Region (...) ---` blocks, the same format built from LlamaSheets regions.
+        Returns None when the layout looks too complex to read reliably (merged cells, many sheets or regions, large grids)
+        or when formulas have no cached result to read.
+        """
+        try:
+            workbook = openpyxl.load_workbook(file_path, data_only=True)
+            formulas = openpyxl.load_workbook(file_path)
+        except Exception as e:
+            logger.warning(f"Could not open {file_path} locally: {e}")
+            return None
+
+        sheets = [ws for ws in workbook.worksheets if ws.sheet_state == "visible"]
+        if len(sheets) > _MAX_SHEETS:
+            return None
+
+        cells = 0
+        content_parts = []
+        for ws in sheets:
+            cells += ws.max_row * ws.max_column
+            if cells > LOCAL_XLSX_MAX_CELLS or ws.merged_cells.ranges:
+                return None
+            if cls._has_uncached_formulas(formulas[ws.title], ws):
+                logger.info(f"{file_path} has formulas without cached values, leaving it to LlamaSheets")
+                return None
+
+            rows = [list(row) for row in ws.iter_rows(values_only=True)]
+            for block in cls._split_regions(rows):
+                content_parts.append(cls._render_region(block))
+
+        if not content_parts or len(content_parts) > _MAX_REGIONS:
+            return None
+        return "\n\n".join(content_parts)
+
+    @staticmethod
+    def _has_uncached_formulas(formulas_ws, values_ws) -> bool:
+        """
+        Whether a formula cell has no stored result. Workbooks written by libraries (not Excel) usually don't store any,
+        and openpyxl can't evaluate them: read locally, totals and amounts would silently be empty.
+        """
+        for row in formulas_ws.iter_rows():
+            for cell in row:
+                if cell.data_type == "f" and values_ws.cell(row=cell.row, column=cell.column).value is None:
+                    return True
+        return False
+
+    @staticmethod
+    def _split_regions(rows: list[list[Any]]) -> list[list[list[Any]]]:
+        """Splits a sheet into blocks separated by empty rows, dropping columns that are empty within a block."""
+        blocks, current = [], []
+        for row in rows + [[]]:
+            if any(value is not None and str(value).strip() for value in row):
+                current.append(row)
+            elif current:
+                blocks.append(current)
+                current = []
+
+        regions = []
+        for block in blocks:
+            width = max(len(row) for row in block)
+            padded = [row + [None] * (width - len(row)) for row in block]
+            keep = [i for i in range(width) if any(row[i] is not None for row in padded)]
+            regions.append([[row[i] for i in keep] for row in padded])
+        return regions
+
+    @staticmethod
+    def _render_region(block: list[list[Any]]) -> str:
+        """Blocks whose first row is all text headers render as a table, anything else as plain extra cells."""
+        values = [["" if value is None else value for value in row] for row in block]
+        header = block[0]
+        is_table = len(block) > 1 and len(header) > 1 and all(isinstance(value, str) for value in header)
+
+        if is_table:
+            df = pd.DataFrame(values[1:], columns=[str(value) for value in header])
+            return f"--- Region (table) ---\n{df.to_string(index=False)}"
+
+        df = pd.DataFrame(values)
+        return f"--- Region (extra) ---\n{df.to_string(index=False, header=False)}"
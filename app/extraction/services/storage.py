@@ -1,8 +1,15 @@
-from sqlalchemy import select, text, or_
+import asyncio
+
+from sqlalchemy import select, update, text, or_, and_
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
-from app.models import Document
-from app.extraction.schemas import CacheField, DocumentCategory
+from sqlalchemy.orm import selectinload, defer
+from app.models import Document, DocumentAlias
+from app.extraction.schemas import CacheField, DocumentCategory, ProcessingStatus
+from app.extraction.services.contracts import ContractSnapshot, contract_snapshots
+from app.extraction.services.passages import get_passage_index
+
+# SQLite caps bound parameters per statement (999 on older builds), so large IN (...) lookups are chunked
+IN_CLAUSE_CHUNK_SIZE = 500
 
 
 class StorageService:
@@ -16,38 +23,136 @@ class StorageService:
         return result.scalars().first()
 
     @staticmethod
-    async def get_doc(db: AsyncSession, file_id: str) -> Document | None:
-        result = await db.execute(select(Document).where(Document.id == file_id))
-        return result.scalars().first()
+    async def get_docs(db: AsyncSession, file_ids: list[str]) -> list[Document]:
+        """Fetches documents by ID (without their text) using batched IN queries."""
+        docs = []
+        for i in range(0, len(file_ids), IN_CLAUSE_CHUNK_SIZE):
+            chunk = file_ids[i:i + IN_CLAUSE_CHUNK_SIZE]
+            result = await db.execute(select(Document).where(Document.id.in_(chunk)).options(defer(Document.text_content)))
+            docs.extend(result.scalars().all())
+        return docs
+
+    @staticmethod
+    async def get_categories(db: AsyncSession, file_ids: list[str]) -> dict[str, str | None]:
+        """Maps each known file ID to its stored category using batched IN queries."""
+        categories = {}
+        for i in range(0, len(file_ids), IN_CLAUSE_CHUNK_SIZE):
+            chunk = file_ids[i:i + IN_CLAUSE_CHUNK_SIZE]
+            result = await db.execute(select(Document.id, Document.category).where(Document.id.in_(chunk)))
+            categories.update(result.tuples().all())
+        return categories
 
     @staticmethod
     async def update_doc(db: AsyncSession, file_id: str, **kwargs) -> None:
-        """Updates specific fields of a document."""
+        """Updates specific fields of a document. Writes touching a contract invalidate the contract snapshot on commit."""
         result = await db.execute(select(Document).where(Document.id == file_id))
         if doc := result.scalars().first():
+            was_contract = doc.is_contract
             for key, value in kwargs.items():
                 setattr(doc, key, value)
+            if was_contract or doc.is_contract:
+                contract_snapshots.mark_changed(db)
 
     @staticmethod
-    async def get_contracts_for_matching(db: AsyncSession) -> list[dict]:
-        """Fetches all processed contracts for reconciliation context."""
-        result = await db.execute(
-            select(Document).where(Document.category == DocumentCategory.CONTRACT.value)
-        )
+    async def _touches_contracts(db: AsyncSession, file_ids: list[str], categories: list) -> bool:
+        """Whether a write to `file_ids` setting `categories` changes a contract (one that was or becomes a contract)."""
+        if DocumentCategory.CONTRACT.value in categories:
+            return True
+        for i in range(0, len(file_ids), IN_CLAUSE_CHUNK_SIZE):
+            chunk = file_ids[i:i + IN_CLAUSE_CHUNK_SIZE]
+            result = await db.execute(
+                select(Document.id).where(Document.id.in_(chunk), Document.category == DocumentCategory.CONTRACT.value).limit(1)
+            )
+            if result.first():
+                return True
+        return False
+
+    @classmethod
+    async def update_docs(cls, db: AsyncSession, file_ids: list[str], **kwargs) -> None:
+        """Sets the same fields on many documents with one UPDATE ... WHERE id IN per chunk of ids."""
+        if not file_ids or not kwargs:
+            return
+        if await cls._touches_contracts(db, file_ids, [kwargs.get("category")]):
+            contract_snapshots.mark_changed(db)
+        for i in range(0, len(file_ids), IN_CLAUSE_CHUNK_SIZE):
+            chunk = file_ids[i:i + IN_CLAUSE_CHUNK_SIZE]
+            await db.execute(
+                update(Document).where(Document.id.in_(chunk)).values(**kwargs).execution_options(synchronize_session=False)
+            )
+
+    @classmethod
+    async def bulk_update_docs(cls, db: AsyncSession, changes: dict[str, dict]) -> None:
+        """
+        Applies per-document field changes (`{file_id: {field: value}}`) as a single executemany UPDATE by primary key.
+        Documents already loaded in `db` are not refreshed, so write through here once they are no longer read.
+        """
+        if not changes:
+            return
+        if await cls._touches_contracts(db, list(changes), [fields.get("category") for fields in changes.values()]):
+            contract_snapshots.mark_changed(db)
+        await db.execute(update(Document), [{"id": file_id, **fields} for file_id, fields in changes.items()])
+
+    @staticmethod
+    async def get_contracts_for_matching(db: AsyncSession, file_ids: list[str] | None = None) -> list[dict]:
+        """Fetches all processed contracts (or only those in `file_ids`) for reconciliation context."""
+        stmt = select(Document).where(Document.category == DocumentCategory.CONTRACT.value)
+        if file_ids is not None:
+            stmt = stmt.where(Document.id.in_(file_ids))
+        result = await db.execute(stmt)
         return [
-            {"id": c.id, "filename": c.filename, "text_content": c.text_content}
+            {"id": c.id, "filename": c.filename, "text_content": c.text_content, "extracted_data": c.extracted_data,
+             "normalized_payment_terms": c.normalized_payment_terms}
             for c in result.scalars().all()
         ]
 
+    @classmethod
+    async def get_contract_snapshot(cls, db: AsyncSession) -> ContractSnapshot:
+        """
+        Current contracts for reconciliation, reloaded only after a contract was written.
+        Reloading also brings the passage index up to date (new, changed and removed contracts).
+        """
+        async def load() -> list[dict]:
+            contracts = await cls.get_contracts_for_matching(db)
+            await asyncio.to_thread(get_passage_index().sync, contracts)
+            return contracts
+
+        return await contract_snapshots.get(load)
+
     @staticmethod
     async def get_pending_invoices(db: AsyncSession) -> list[Document]:
-        """Fetches invoices that have been extracted but not reconciled."""
-        stmt = select(Document).where(
-            Document.category == DocumentCategory.INVOICE.value,
-            Document.extracted_data.is_not(None)
+        """Fetches invoices that have been extracted but not matched to a contract."""
+        stmt = (
+            select(Document)
+            .where(
+                Document.category == DocumentCategory.INVOICE.value,
+                Document.status == ProcessingStatus.EXTRACTED.value,
+                Document.contract_id.is_(None),
+            )
+            .options(defer(Document.text_content))
         )
         result = await db.execute(stmt)
-        return [doc for doc in result.scalars().all() if not doc.extracted_data.get('matched_contract_id')]
+        return list(result.scalars().all())
+
+    @classmethod
+    async def reset_reconciliation(cls, db: AsyncSession, contract_ids: list[str]) -> int:
+        """Drops the reconciliation results of invoices matched to `contract_ids`, making them pending again."""
+        if not contract_ids:
+            return 0
+        result = await db.execute(
+            select(Document.id, Document.extracted_data).where(Document.contract_id.in_(contract_ids))
+        )
+        changes = {
+            invoice_id: {
+                "extracted_data": {k: v for k, v in (extracted_data or {}).items() if k != "matched_contract_id"},
+                "contract_id": None,
+                "reconciliation_notes": None,
+                "reconciliation_engine": None,
+                "discrepancies": None,
+            }
+            for invoice_id, extracted_data in result.tuples().all()
+        }
+        await cls.bulk_update_docs(db, changes)
+        return len(changes)
 
     @staticmethod
     async def get_dashboard_view_data(db: AsyncSession) -> list[Document]:
@@ -65,7 +170,7 @@ class StorageService:
         return list(result.scalars().all())
 
     @staticmethod
-    async def get_or_create_document(db: AsyncSession, file_id: str, filename: str) -> Document:
+    async def get_or_create_document(db: AsyncSession, file_id: str, filename: str, content_hash: str | None = None) -> Document:
         """Creates a new document record or returns existing one."""
         # Check existence
         result = await db.execute(select(Document).where(Document.filename == filename))
@@ -73,26 +178,39 @@ class StorageService:
             return existing
 
         # Create new
-        new_doc = Document(id=file_id, filename=filename, category="processing")
+        new_doc = Document(id=file_id, filename=filename, content_hash=content_hash, status=ProcessingStatus.PROCESSING.value)
         db.add(new_doc)
         return new_doc
 
+    @staticmethod
+    async def get_doc_by_content_hash(db: AsyncSession, content_hash: str) -> Document | None:
+        result = await db.execute(select(Document).where(Document.content_hash == content_hash))
+        return result.scalars().first()
+
+    @staticmethod
+    async def add_alias(db: AsyncSession, filename: str, document_id: str) -> None:
+        """Points `filename` at an existing document holding the same content."""
+        await db.merge(DocumentAlias(filename=filename, document_id=document_id))
+
     @staticmethod
     async def get_file_ids_by_filenames(db: AsyncSession, filenames: list[str]) -> list[str]:
-        """Retrieves file IDs for a list of filenames."""
-        result = await db.execute(select(Document).where(Document.filename.in_(filenames)))
-        return [d.id for d in result.scalars().all()]
+        """Retrieves file IDs for a list of filenames, resolving aliases. Duplicates are collapsed."""
+        result = await db.execute(select(Document.id).where(Document.filename.in_(filenames)))
+        ids = list(result.scalars().all())
+
+        result = await db.execute(select(DocumentAlias.document_id).where(DocumentAlias.filename.in_(filenames)))
+        ids.extend(result.scalars().all())
+        return list(dict.fromkeys(ids))
 
     @staticmethod
     async def get_incomplete_file_ids(db: AsyncSession) -> list[str]:
-        """Retrieves IDs of documents that are failed, stuck processing, or unmatched invoices."""
-        result = await db.execute(select(Document))
-        docs = result.scalars().all()
-        ids = []
-        for d in docs:
-            if d.category in ["processing", "failed", "unknown", "other"]:
-                ids.append(d.id)
-            elif d.category == "invoice":
-                if not d.extracted_data or not d.extracted_data.get("matched_contract_id"):
-                    ids.append(d.id)
-        return ids
\ No newline at end of file
+        """Retrieves IDs of documents that are failed, stuck processing, unmatched invoices or suspect extractions."""
+        stmt = select(Document.id).where(or_(
+            Document.status.in_([ProcessingStatus.PROCESSING.value, ProcessingStatus.FAILED.value, ProcessingStatus.SKIPPED.value]),
+            and_(
+                Document.category == DocumentCategory.INVOICE.value,
+                or_(Document.contract_id.is_(None), Document.extraction_suspect.is_(True)),
+            ),
+        ))
+        result = await db.execute(stmt)
+        return list(result.scalars().all())
\ No newline at end of file
@@ -0,0 +1,50 @@
+import logging
+import os
+import unicodedata
+
+from pypdf import PdfReader
+
+logger = logging.getLogger(__name__)
+
+TEXT_LAYER_MIN_QUALITY = float(os.getenv("TEXT_LAYER_MIN_QUALITY", "0.85"))
+
+_MIN_CHARS_PER_PAGE = 100
+
+
+class TextLayerService:
+    """Service for reading the embedded text layer of PDFs locally, without any remote call."""
+
+    @staticmethod
+    def read_pages(file_path: str, max_pages: int | None = None) -> list[str]:
+        """Returns the text of each page (up to `max_pages`), or an empty list if the PDF cannot be read."""
+        try:
+            reader = PdfReader(file_path)
+            pages = reader.pages if max_pages is None else reader.pages[:max_pages]
+            return [page.extract_text() or "" for page in pages]
+        except Exception as e:
+            logger.warning(f"Could not read text layer of {file_path}: {e}")
+            return []
+
+    @staticmethod
+    def score(pages: list[str]) -> float:
+        """
+        Quality of an extracted text layer in [0, 1]: the share of pages carrying real text,
+        penalised by the share of garbage characters (replacement glyphs, private-use and control characters).
+        """
+        if not pages:
+            return 0.0
+
+        covered = sum(1 for page in pages if len("".join(page.split())) >= _MIN_CHARS_PER_PAGE)
+        coverage = covered / len(pages)
+
+        chars = [c for c in "".join(pages) if not c.isspace()]
+        if not chars:
+            return 0.0
+        garbage = sum(
+            1 for c in chars
+            if c == "\ufffd" or not (c.isalnum() or unicodedata.category(c).startswith(("P", "S")))
+        )
+        garbage_ratio = garbage / len(chars)
+
+        # A few percent of garbage already means a broken font mapping
+        return coverage * max(0.0, 1.0 - 10 * garbage_ratio)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from app.extraction.schemas import ArithmeticIssue, InvoiceData
+
+# Amounts are considered equal within max(_ABS_TOLERANCE, _REL_TOLERANCE * expected)
+_ABS_TOLERANCE = 0.01
+_REL_TOLERANCE = 0.005
+
+
+def _tolerance(expected: np.ndarray) -> np.ndarray:
+    return np.maximum(_ABS_TOLERANCE, _REL_TOLERANCE * np.abs(expected))
+
+
+def _mismatch(actual: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    known = ~(np.isnan(actual) | np.isnan(expected))
+    return known & (np.abs(actual - expected) > _tolerance(expected))
+
+
+def _float(value: float | None) -> float:
+    return np.nan if value is None else float(value)
+
+
+class LineItemValidator:
+    """
+    Arithmetic checks of extracted invoices, run over many invoices at once on columnar arrays:
+    `quantity * unit_price ≈ amount` for every line item, and `sum(amount) ≈ subtotal` when the invoice prints one.
+    Without a subtotal only a total below the line items is flagged, a higher one can be unitemized tax or shipping.
+    """
+
+    @staticmethod
+    def validate(invoices: list[InvoiceData]) -> tuple[list[list[ArithmeticIssue]], list[bool]]:
+        """Returns the arithmetic issues of each invoice, and whether its extraction is suspect (it has any)."""
+        issues = [[] for _ in invoices]
+        if not invoices:
+            return issues, []
+
+        items = [(i, n, item) for i, invoice in enumerate(invoices) for n, item in enumerate(invoice.line_items)]
+        owner = np.array([i for i, _, _ in items], dtype=np.intp)
+        quantity = np.array([_float(item.quantity) for _, _, item in items])
+        unit_price = np.array([_float(item.unit_price) for _, _, item in items])
+        amount = np.array([_float(item.amount) for _, _, item in items])
+        subtotal = np.array([_float(invoice.subtotal) for invoice in invoices])
+        total = np.array([_float(invoice.total_amount) for invoice in invoices])
+
+        expected_amount = quantity * unit_price
+        bad_lines = _mismatch(amount, expected_amount)
+
+        known_amount = ~np.isnan(amount)
+        line_sum = np.bincount(owner, weights=np.where(known_amount, amount, 0.0), minlength=len(invoices))
+        has_amounts = np.bincount(owner, weights=known_amount, minlength=len(invoices)) > 0
+        line_sum = np.where(has_amounts, line_sum, np.nan)
+        bad_subtotals = _mismatch(subtotal, line_sum)
+        bad_totals = np.isnan(subtotal) & ~np.isnan(total) & (line_sum - total > _tolerance(line_sum))
+
+        for k in np.flatnonzero(bad_lines):
+            i, n, item = items[k]
+            issues[i].append(ArithmeticIssue(
+                field=f"line_items[{n}].amount",
+                invoice_value=str(item.amount),
+                expected_value=f"{expected_amount[k]:.2f} (quantity x unit price)",
+                issue=f"Line item amount does not match {item.quantity} x {item.unit_price}",
+            ))
+        for i in np.flatnonzero(bad_subtotals):
+            issues[i].append(ArithmeticIssue(
+                field="subtotal",
+                invoice_value=str(invoices[i].subtotal),
+                expected_value=f"{line_sum[i]:.2f} (sum of line items)",
+                issue="Invoice subtotal does not match the sum of its line items",
+            ))
+        for i in np.flatnonzero(bad_totals):
+            issues[i].append(ArithmeticIssue(
+                field="total_amount",
+                invoice_value=str(invoices[i].total_amount),
+                expected_value=f"at least {line_sum[i]:.2f} (sum of line items)",
+                issue="Invoice total is lower than the sum of its line items",
+            ))
+
+        suspect = (np.bincount(owner, weights=bad_lines, minlength=len(invoices)) > 0) | bad_subtotals | bad_totals
+        return issues, suspect.tolist()
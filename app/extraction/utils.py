@@ -1,6 +1,6 @@
 import logging
 
-from starlette.websockets import WebSocket
+from starlette.websockets import WebSocket, WebSocketDisconnect
 
 
 logger = logging.getLogger(__name__)
@@ -17,3 +17,12 @@ class WebSocketConnectionManager:
     async def send_text(self, data: str):
         logger.debug(f"Sending text message: {data}")
         await self.websocket.send_text(data)
+
+    async def receive(self) -> str | bytes:
+        """Receives the next frame, returning text frames as str and binary frames as bytes."""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            return message["bytes"]
+        return message["text"]
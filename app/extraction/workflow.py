@@ -1,4 +1,7 @@
+import asyncio
+import contextlib
 import logging
+import os
 from workflows import Context, Workflow, step
 from workflows.events import StopEvent
 
@@ -8,8 +11,10 @@ from app.extraction.events import (
     FileClassifiedEvent,
     ExtractionFinishedEvent,
     ReconcileInvoiceEvent,
+    ReconcileBatchEvent,
     ProcessingCompleteEvent,
     BatchIngestionCompletedEvent,
+    FileInfo,
 )
 from app.extraction.schemas import (
     CacheField,
@@ -18,16 +23,30 @@ from app.extraction.schemas import (
     InvoiceData,
     ProcessingResult,
     Discrepancy,
+    InvoiceReconciliationInput,
+    ProcessingStatus,
+    PaymentTerms,
 )
 from app.db import sessionmanager
+from app.extraction.cache import refresh_predictions
+from app.extraction.clients import get_structured_llm_if_created
 from app.extraction.services.storage import StorageService
 from app.extraction.services.ingestion import IngestionService
 from app.extraction.services.classification import ClassificationService
 from app.extraction.services.extraction import ExtractionService
+from app.extraction.services.candidates import ContractCandidateIndex
+from app.extraction.services.passages import get_passage_index
 from app.extraction.services.reconciliation import ReconciliationService
+from app.extraction.services.validation import LineItemValidator
+from app.models import Document
 
 logger = logging.getLogger(__name__)
 
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "8"))
+# Upper bounds per run; the actual load on each provider is governed by the shared limiters in app.extraction.ratelimit
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "8"))
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", "8"))
+
 
 class DocumentAutomationWorkflow(Workflow):
     """
@@ -45,18 +64,26 @@ class DocumentAutomationWorkflow(Workflow):
 
     @step
     async def ingest(self, event: FilesUploadedEvent, ctx: Context) -> BatchIngestionCompletedEvent | None:
-        """Downloads files using IngestionService."""
-        ctx.write_event_to_stream(StatusEvent(message=f"Starting processing for {len(event.file_ids)} files"))
-
-        downloaded_files = []
-        for file_id in event.file_ids:
-            try:
-                file_info = await self.ingestion.download_file(file_id)
-                ctx.write_event_to_stream(StatusEvent(file_id=file_id, message=f"Downloaded {file_info.filename}"))
-                downloaded_files.append(file_info)
-            except Exception as e:
-                ctx.write_event_to_stream(StatusEvent(file_id=file_id, message=f"Download failed: {e}", level="error"))
-                pass
+        """Downloads files concurrently (at most INGEST_CONCURRENCY at a time) using IngestionService."""
+        # Aliased uploads resolve to the same document, process it once
+        file_ids = list(dict.fromkeys(event.file_ids))
+        ctx.write_event_to_stream(StatusEvent(message=f"Starting processing for {len(file_ids)} files"))
+
+        semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+
+        async def download(file_id: str) -> FileInfo | None:
+            async with semaphore:
+                try:
+                    file_info = await self.ingestion.download_file(file_id)
+                except Exception as e:
+                    ctx.write_event_to_stream(StatusEvent(file_id=file_id, message=f"Download failed: {e}", level="error"))
+                    return None
+            ctx.write_event_to_stream(StatusEvent(file_id=file_id, message=f"Downloaded {file_info.filename}"))
+            return file_info
+
+        # gather keeps the input order, so downstream steps see files in the order they were requested
+        results = await asyncio.gather(*(download(file_id) for file_id in file_ids))
+        downloaded_files = [file_info for file_info in results if file_info]
 
         if downloaded_files:
             await ctx.store.set("num_files", len(downloaded_files))
@@ -65,131 +92,174 @@ class DocumentAutomationWorkflow(Workflow):
 
     @step
     async def classify(self, event: BatchIngestionCompletedEvent, ctx: Context) -> FileClassifiedEvent | ExtractionFinishedEvent | None:
-        """Classifies files using ClassificationService."""
+        """Classifies files using ClassificationService, dispatching each file as soon as its classification arrives."""
         ctx.write_event_to_stream(StatusEvent(message=f"Classifying batch of {len(event.files)} files..."))
 
         for f in event.files:
             ctx.write_event_to_stream(StatusEvent(file_id=f.file_id, message="Classifying..."))
 
-        results = {}
+        files_by_id = {f.file_id: f for f in event.files}
+        classified = set()
         async with sessionmanager.session() as db:
             try:
-                results = await self.classification.classify_files(db, event.files)
+                async for results in self.classification.iter_classifications(db, event.files):
+                    results = {file_id: c for file_id, c in results.items() if file_id in files_by_id}
+                    # One transaction per arriving batch, committed before its files move on to extraction
+                    async with sessionmanager.session() as write_db:
+                        await self.storage.bulk_update_docs(
+                            write_db, {file_id: self._classified_fields(c) for file_id, c in results.items()}
+                        )
+                    for file_id, classification in results.items():
+                        classified.add(file_id)
+                        self._dispatch_classified(ctx, files_by_id[file_id], classification)
             except Exception as e:
                 ctx.write_event_to_stream(StatusEvent(message=f"Batch classification error: {e}", level="error"))
 
-        for f_info in event.files:
-            classification = results.get(f_info.file_id)
-            if not classification:
-                ctx.write_event_to_stream(StatusEvent(file_id=f_info.file_id, message="Classification failed.", level="error"))
-                async with sessionmanager.session() as db:
-                    await self.storage.update_doc(db, f_info.file_id, category="failed", reconciliation_notes="Classification failed.")
-                ctx.send_event(ExtractionFinishedEvent(
+        failed = [f_info for f_info in event.files if f_info.file_id not in classified]
+        if failed:
+            async with sessionmanager.session() as db:
+                await self.storage.update_docs(
+                    db, [f_info.file_id for f_info in failed],
+                    status=ProcessingStatus.FAILED.value, reconciliation_notes="Classification failed.",
+                )
+
+        for f_info in failed:
+            ctx.write_event_to_stream(StatusEvent(file_id=f_info.file_id, message="Classification failed.", level="error"))
+            ctx.send_event(ExtractionFinishedEvent(
+                file_id=f_info.file_id,
+                status="skipped",
+                filename=f_info.filename,
+                result=ProcessingResult(
                     file_id=f_info.file_id,
-                    status="skipped",
                     filename=f_info.filename,
-                    result=ProcessingResult(
-                        file_id=f_info.file_id,
-                        filename=f_info.filename,
-                        classification=DocumentClassification(
-                            file_type="unknown",
-                            document_category=DocumentCategory.OTHER,
-                            confidence=0.0
-                        ),
-                        reconciliation_notes="Skipped: Classification failed."
-                    )
-                ))
-                continue
-
-            ctx.write_event_to_stream(
-                StatusEvent(
-                    file_id=f_info.file_id,
-                    message=f"Classified as {classification.document_category.value} ({classification.file_type})"
+                    classification=DocumentClassification(
+                        file_type="unknown",
+                        document_category=DocumentCategory.OTHER,
+                        confidence=0.0
+                    ),
+                    reconciliation_notes="Skipped: Classification failed."
                 )
+            ))
+
+    @staticmethod
+    def _classified_fields(classification: DocumentClassification) -> dict:
+        """Document fields to store for a classified file."""
+        fields = {"category": classification.document_category.value}
+        if classification.document_category == DocumentCategory.OTHER:
+            fields.update(status=ProcessingStatus.SKIPPED.value, reconciliation_notes="Skipped: Unsupported category.")
+        return fields
+
+    @staticmethod
+    def _dispatch_classified(ctx: Context, f_info: FileInfo, classification: DocumentClassification) -> None:
+        """Sends a classified file, whose category is already stored, to extraction (or skips it)."""
+        ctx.write_event_to_stream(
+            StatusEvent(
+                file_id=f_info.file_id,
+                message=f"Classified as {classification.document_category.value} ({classification.file_type})"
             )
+        )
 
-            async with sessionmanager.session() as db:
-                await self.storage.update_doc(
-                    db, 
-                    f_info.file_id, 
-                    category=classification.document_category.value
-                )
-
-            if classification.document_category == DocumentCategory.OTHER:
-                async with sessionmanager.session() as db:
-                    await self.storage.update_doc(db, f_info.file_id, category="other", reconciliation_notes="Skipped: Unsupported category.")
-                ctx.send_event(ExtractionFinishedEvent(
-                    file_id=f_info.file_id,
-                    status="skipped",
-                    result=ProcessingResult(
-                        file_id=f_info.file_id,
-                        filename=f_info.filename,
-                        classification=classification,
-                        reconciliation_notes="Skipped: Unsupported category."
-                    )))
-            else:
-                ctx.send_event(FileClassifiedEvent(
+        if classification.document_category == DocumentCategory.OTHER:
+            ctx.send_event(ExtractionFinishedEvent(
+                file_id=f_info.file_id,
+                status="skipped",
+                result=ProcessingResult(
                     file_id=f_info.file_id,
                     filename=f_info.filename,
-                    file_path=f_info.file_path,
-                    classification=classification
-                ))
-
-    @step(num_workers=4)
+                    classification=classification,
+                    reconciliation_notes="Skipped: Unsupported category."
+                )))
+        else:
+            ctx.send_event(FileClassifiedEvent(
+                file_id=f_info.file_id,
+                filename=f_info.filename,
+                file_path=f_info.file_path,
+                classification=classification
+            ))
+
+    @staticmethod
+    def _invoice_data(extracted_data: dict) -> InvoiceData:
+        """The extracted invoice fields, without the matched contract id that reconciliation stores alongside them."""
+        return InvoiceData(**{k: v for k, v in extracted_data.items() if k != "matched_contract_id"})
+
+    @staticmethod
+    def _stored_result(doc: Document, filename: str, classification: DocumentClassification, extracted_data: dict) -> ProcessingResult:
+        """The reconciliation result stored for an invoice by an earlier run."""
+        return ProcessingResult(
+            file_id=doc.id,
+            filename=filename,
+            classification=classification,
+            matched_contract_id=doc.contract_id,
+            extracted_data=extracted_data,
+            reconciliation_notes=doc.reconciliation_notes,
+            reconciliation_engine=doc.reconciliation_engine,
+            discrepancies=[Discrepancy(**d) for d in (doc.discrepancies or [])]
+        )
+
+    @step(num_workers=EXTRACT_WORKERS)
     async def extract(self, event: FileClassifiedEvent, ctx: Context) -> ExtractionFinishedEvent:
         """Extracts data using ExtractionService based on classification."""
 
         # hacky
         field = CacheField.TEXT_CONTENT if event.classification.document_category == DocumentCategory.CONTRACT else CacheField.EXTRACTED_DATA
         
+        refresh = False
         async with sessionmanager.session() as db:
-            if doc := await self.storage.get_cached_doc(db, event.file_id, field):
+            if (doc := await self.storage.get_cached_doc(db, event.file_id, field)) and doc.extraction_suspect:
+                # Its line items didn't add up: extract again, without reusing cached predictions
+                refresh = True
+            elif doc:
                 ctx.write_event_to_stream(StatusEvent(file_id=event.file_id, message="Using cached data..."))
-                data = doc.text_content if field == CacheField.TEXT_CONTENT else InvoiceData(**doc.extracted_data).model_dump()
+                if doc.status != ProcessingStatus.EXTRACTED.value:
+                    # Extracted before, then failed at an earlier step of a later run
+                    await self.storage.update_doc(db, event.file_id, status=ProcessingStatus.EXTRACTED.value)
+                data = doc.text_content if field == CacheField.TEXT_CONTENT else self._invoice_data(doc.extracted_data).model_dump()
                 return ExtractionFinishedEvent(
                     file_id=event.file_id, filename=event.filename,
                     status="success",
                     classification=event.classification, category=event.classification.document_category,
-                    data=data
+                    data=data,
+                    cached=True,
                 )
 
             ctx.write_event_to_stream(StatusEvent(file_id=event.file_id, message="Extracting content..."))
 
         try:
-            result_data = await self.extraction.extract(event.file_path, event.classification)
+            with refresh_predictions() if refresh else contextlib.nullcontext():
+                output = await self.extraction.extract(event.file_path, event.classification)
 
             async with sessionmanager.session() as db:
-                # Handle Contract (Composite Result: Text + Data) vs Invoice (Data only)
+                # Contracts also keep their text (reconciliation context), invoices only the data
+                fields = {
+                    "extracted_data": output.extracted_data,
+                    "parse_source": output.parse_source.value if output.parse_source else None,
+                    "normalized_payment_terms": output.payment_terms.model_dump() if output.payment_terms else None,
+                    "extraction_suspect": False,
+                    "status": ProcessingStatus.EXTRACTED.value,
+                }
                 if event.classification.document_category == DocumentCategory.CONTRACT:
-                    # result_data is {"text_content": str, "extracted_data": dict}
-                    text_content = result_data.get("text_content")
-                    extracted_data = result_data.get("extracted_data")
-
-                    await self.storage.update_doc(
-                        db,
-                        event.file_id,
-                        text_content=text_content,
-                        extracted_data=extracted_data
-                    )
-                    final_data = extracted_data
-                else:
-                    await self.storage.update_doc(
-                        db,
-                        event.file_id,
-                        extracted_data=result_data
-                    )
-                    final_data = result_data
+                    fields["text_content"] = output.text_content
+                if refresh:
+                    # The old match was made on the data being replaced: pending again, validated and reconciled anew
+                    fields.update(contract_id=None, reconciliation_notes=None, reconciliation_engine=None, discrepancies=None)
+
+                await self.storage.update_doc(db, event.file_id, **fields)
+
+            if event.classification.document_category == DocumentCategory.CONTRACT:
+                await asyncio.to_thread(get_passage_index().add, event.file_id, output.text_content)
 
             return ExtractionFinishedEvent(
                 file_id=event.file_id, filename=event.filename,
                 status="success",
                 classification=event.classification, category=event.classification.document_category,
-                data=final_data
+                data=output.extracted_data
             )
         except Exception as e:
             ctx.write_event_to_stream(StatusEvent(file_id=event.file_id, message=f"Extraction error: {e}", level="warning"))
             async with sessionmanager.session() as db:
-                await self.storage.update_doc(db, event.file_id, category="failed", reconciliation_notes=f"Extraction failed: {e}")
+                await self.storage.update_doc(
+                    db, event.file_id, status=ProcessingStatus.FAILED.value, reconciliation_notes=f"Extraction failed: {e}"
+                )
             return ExtractionFinishedEvent(
                 file_id=event.file_id,
                 status="skipped",
@@ -204,9 +274,11 @@ class DocumentAutomationWorkflow(Workflow):
         self,
         ctx: Context,
         event: ExtractionFinishedEvent
-    ) -> ReconcileInvoiceEvent | ProcessingCompleteEvent | None:
+    ) -> ReconcileBatchEvent | ProcessingCompleteEvent | None:
         """
         Barrier step: Collects all results, triggers reconciliation for invoices.
+        Only what this run can change is reconciled: its own invoices, and earlier pending invoices that a new or
+        re-extracted contract could plausibly match. Invoices matched to a re-extracted contract are reconciled again.
         """
         num_files = await ctx.store.get("num_files")
         events = ctx.collect_events(event, [ExtractionFinishedEvent] * num_files)
@@ -231,80 +303,151 @@ class DocumentAutomationWorkflow(Workflow):
                 ctx.send_event(ProcessingCompleteEvent(result=res))
                 completed_count += 1
 
+        run_ids = {ev.file_id for ev in events}
+        changed_contract_ids = [
+            ev.file_id for ev in events
+            if ev.status == "success" and ev.category == DocumentCategory.CONTRACT and not ev.cached
+        ]
+
         async with sessionmanager.session() as db:
-            invoices_to_reconcile = await self.storage.get_pending_invoices(db)
+            if reset := await self.storage.reset_reconciliation(db, changed_contract_ids):
+                logger.info(f"{reset} invoices matched to re-extracted contracts will be reconciled again")
+
+            changed_contracts = ContractCandidateIndex(await self.storage.get_contracts_for_matching(db, changed_contract_ids))
+            invoices_to_reconcile = [
+                inv for inv in await self.storage.get_pending_invoices(db)
+                # Never reconciled yet (new, reset or interrupted), part of this run, or a candidate for a changed contract
+                if inv.reconciliation_notes is None
+                or inv.id in run_ids
+                or self.reconciliation.is_affected(InvoiceData(**inv.extracted_data), changed_contracts)
+            ]
+
+            # Invoices of this run that are already reconciled (e.g. re-uploaded duplicates) complete with their stored result
+            pending_ids = {inv.id for inv in invoices_to_reconcile}
+            reconciled = {
+                ev.file_id: ev for ev in events
+                if ev.status == "success" and ev.category == DocumentCategory.INVOICE and ev.file_id not in pending_ids
+            }
+            for doc in await self.storage.get_docs(db, list(reconciled)):
+                ev = reconciled[doc.id]
+                res = self._stored_result(doc, ev.filename, ev.classification, doc.extracted_data)
+                ctx.write_event_to_stream(ProcessingCompleteEvent(result=res))
+                ctx.send_event(ProcessingCompleteEvent(result=res))
+                completed_count += 1
 
-            for inv in invoices_to_reconcile:
-                ctx.send_event(ReconcileInvoiceEvent(
+            # Arithmetic of all their line items, checked in one pass
+            invoices_data = [self._invoice_data(inv.extracted_data) for inv in invoices_to_reconcile]
+            arithmetic_issues, suspect = LineItemValidator.validate(invoices_data)
+            # Stored apart from the contract discrepancies, they are about the extraction, not the match
+            changes = {}
+            for inv, issues, is_suspect in zip(invoices_to_reconcile, arithmetic_issues, suspect):
+                fields = {"extraction_suspect": is_suspect, "arithmetic_issues": [issue.model_dump() for issue in issues] or None}
+                if is_suspect != bool(inv.extraction_suspect) or fields["arithmetic_issues"] != inv.arithmetic_issues:
+                    changes[inv.id] = fields
+            await self.storage.bulk_update_docs(db, changes)
+            if any(suspect):
+                logger.warning(f"{sum(suspect)} invoices have line items that don't add up, they will be re-extracted on retry")
+
+            # Everything the rules can decide, payment terms audited for all of them in one pass
+            snapshot = await self.storage.get_contract_snapshot(db)
+            rules_decisions = self.reconciliation.decide_with_rules(
+                invoices_data,
+                [PaymentTerms(**inv.normalized_payment_terms) if inv.normalized_payment_terms else None for inv in invoices_to_reconcile],
+                snapshot,
+            )
+            logger.info(f"{sum(d is not None for d in rules_decisions)} of {len(invoices_to_reconcile)} invoices decided by rules")
+
+            invoice_events = [
+                ReconcileInvoiceEvent(
                     file_id=inv.id,
                     filename=inv.filename,
                     classification=DocumentClassification(
                         file_type="pdf", document_category=DocumentCategory.INVOICE, confidence=1.0
                     ),
-                    invoice_data=InvoiceData(**inv.extracted_data)
-                ))
+                    invoice_data=invoice_data,
+                    rules_decision=decision,
+                )
+                for inv, invoice_data, decision in zip(invoices_to_reconcile, invoices_data, rules_decisions)
+            ]
+            batches = self.reconciliation.plan_batches(
+                [InvoiceReconciliationInput(filename=ev.filename, invoice_data=ev.invoice_data) for ev in invoice_events],
+                snapshot,
+                rules_decisions,
+            )
+            for batch in batches:
+                ctx.send_event(ReconcileBatchEvent(invoices=[invoice_events[position] for position in batch]))
 
-        # we also reprocess invoices that were pending (from other workflows)
+        # we also reprocess invoices that were pending (from other workflows) and are affected by this run
         new_total = completed_count + len(invoices_to_reconcile)
         await ctx.store.set("num_files", new_total)
 
         return None
 
-    @step(num_workers=4)
-    async def reconcile(self, ctx: Context, event: ReconcileInvoiceEvent) -> ProcessingCompleteEvent:
-        """Reconciles invoice against all contracts using ReconciliationService."""
+    @step(num_workers=RECONCILE_WORKERS)
+    async def reconcile(self, ctx: Context, event: ReconcileBatchEvent) -> ProcessingCompleteEvent | None:
+        """Reconciles a group of invoices against all contracts using ReconciliationService."""
 
         async with sessionmanager.session() as db:
-            doc = await self.storage.get_cached_doc(db, event.file_id, CacheField.RECONCILIATION_NOTES)
-            if doc and "No matching contract" not in (doc.reconciliation_notes or ""):
-                ctx.write_event_to_stream(StatusEvent(file_id=event.file_id, message="Using cached Reconciliation results..."))
-                result = ProcessingResult(
-                    file_id=event.file_id,
-                    filename=event.filename,
-                    classification=event.classification,
-                    matched_contract_id=doc.extracted_data.get("matched_contract_id") if doc.extracted_data else None,
-                    extracted_data=event.invoice_data.model_dump(),
-                    reconciliation_notes=doc.reconciliation_notes,
-                    discrepancies=[Discrepancy(**d) for d in (doc.discrepancies or [])]
-                )
-                return ProcessingCompleteEvent(result=result)
+            to_reconcile = []
+            for inv in event.invoices:
+                doc = await self.storage.get_cached_doc(db, inv.file_id, CacheField.RECONCILIATION_NOTES)
+                if doc and "No matching contract" not in (doc.reconciliation_notes or ""):
+                    ctx.write_event_to_stream(StatusEvent(file_id=inv.file_id, message="Using cached Reconciliation results..."))
+                    result = self._stored_result(doc, inv.filename, inv.classification, inv.invoice_data.model_dump())
+                    ctx.send_event(ProcessingCompleteEvent(result=result))
+                else:
+                    ctx.write_event_to_stream(StatusEvent(file_id=inv.file_id, message="Reconciling..."))
+                    to_reconcile.append(inv)
 
-            ctx.write_event_to_stream(StatusEvent(file_id=event.file_id, message="Reconciling..."))
+            if not to_reconcile:
+                return None
 
-            contracts = await self.storage.get_contracts_for_matching(db)
-            matched_id, notes, discrepancies = await self.reconciliation.reconcile(
-                event.invoice_data, contracts
+            snapshot = await self.storage.get_contract_snapshot(db)
+            outcomes = await self.reconciliation.reconcile_batch(
+                [InvoiceReconciliationInput(filename=inv.filename, invoice_data=inv.invoice_data) for inv in to_reconcile],
+                snapshot,
+                [inv.rules_decision for inv in to_reconcile],
             )
 
-            final_data = event.invoice_data.model_dump()
-            if matched_id:
-                final_data["matched_contract_id"] = matched_id
+            completed, changes = [], {}
+            for inv in to_reconcile:
+                matched_id, notes, discrepancies, engine = outcomes[inv.filename]
+                logger.info(f"{inv.filename} reconciled by {engine.value}")
 
-            result = ProcessingResult(
-                file_id=event.file_id,
-                filename=event.filename,
-                classification=event.classification,
-                matched_contract_id=matched_id,
-                extracted_data=final_data,
-                reconciliation_notes=notes,
-                discrepancies=[d.model_dump() for d in discrepancies],
-            )
+                final_data = inv.invoice_data.model_dump()
+                if matched_id:
+                    final_data["matched_contract_id"] = matched_id
 
-            await self.storage.update_doc(
-                db,
-                event.file_id,
-                extracted_data=final_data,
-                reconciliation_notes=notes,
-                discrepancies=[d.model_dump() for d in discrepancies],
-                contract_id=matched_id
-            )
+                result = ProcessingResult(
+                    file_id=inv.file_id,
+                    filename=inv.filename,
+                    classification=inv.classification,
+                    matched_contract_id=matched_id,
+                    extracted_data=final_data,
+                    reconciliation_notes=notes,
+                    reconciliation_engine=engine,
+                    discrepancies=[d.model_dump() for d in discrepancies],
+                )
+
+                changes[inv.file_id] = {
+                    "extracted_data": final_data,
+                    "reconciliation_notes": notes,
+                    "reconciliation_engine": engine.value,
+                    "discrepancies": [d.model_dump() for d in discrepancies],
+                    "contract_id": matched_id,
+                }
+                completed.append((result, discrepancies))
 
-        msg = "Match confirmed." if not discrepancies else f"{len(discrepancies)} discrepancies."
-        ctx.write_event_to_stream(StatusEvent(file_id=event.file_id, message=msg))
+            await self.storage.bulk_update_docs(db, changes)
 
-        completion_event = ProcessingCompleteEvent(result=result)
-        ctx.write_event_to_stream(completion_event)
-        return completion_event
+        for result, discrepancies in completed:
+            msg = "Match confirmed." if not discrepancies else f"{len(discrepancies)} discrepancies."
+            ctx.write_event_to_stream(StatusEvent(file_id=result.file_id, message=msg))
+
+            completion_event = ProcessingCompleteEvent(result=result)
+            ctx.write_event_to_stream(completion_event)
+            ctx.send_event(completion_event)
+        return None
 
     @step
     async def finalize(
@@ -316,5 +459,8 @@ class DocumentAutomationWorkflow(Workflow):
         if results is None:
             return None
 
+        if llm := get_structured_llm_if_created():
+            logger.info(f"Prediction cache: {llm.hits} hits, {llm.misses} misses since startup")
+
         final_results = [ev.result for ev in results]
         return StopEvent(result=final_results)
\ No newline at end of file
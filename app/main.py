@@ -5,6 +5,7 @@ from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from app.extraction.routes.htmx import router as extraction_htmx_router
 from app.db import sessionmanager, Base
+from app.models import backfill_added_columns
 
 
 logging.basicConfig(
@@ -14,7 +15,7 @@ logging.basicConfig(
 
 @asynccontextmanager
 async def lifespan(app: FastAPI): # noqa
-    await sessionmanager.create_tables(Base)
+    await sessionmanager.create_tables(Base, backfill_added_columns)
     yield
     await sessionmanager.cleanup()
 
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, String, JSON, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, JSON, Text, DateTime, ForeignKey, Boolean, Connection, or_, update
 from sqlalchemy.orm import relationship, backref
 from app.db import Base
 
@@ -9,14 +9,20 @@ class Document(Base):
 
     id = Column(String, primary_key=True)  # This matches the LlamaCloud file_id (dw, it is a PoC xd)
     filename = Column(String, index=True, unique=True)
-    # todo category should not be 'processing' or 'failed'.. update this hack later
-    category = Column(String)  # 'invoice', 'contract', 'other'
-    contract_id = Column(String, ForeignKey("documents.id"), nullable=True)
+    content_hash = Column(String, index=True, unique=True, nullable=True)  # sha256 of the uploaded bytes
+    category = Column(String, index=True)  # DocumentCategory, None until classified
+    status = Column(String, index=True, default="processing")  # ProcessingStatus
+    contract_id = Column(String, ForeignKey("documents.id"), index=True, nullable=True)  # Matched contract of an invoice
     extracted_data = Column(JSON, nullable=True)
+    normalized_payment_terms = Column(JSON, nullable=True)  # PaymentTerms parsed from the extracted payment terms
+    extraction_suspect = Column(Boolean, default=False)  # Line items don't add up, re-extracted on retry
+    arithmetic_issues = Column(JSON, nullable=True)  # ArithmeticIssue list of an invoice, apart from contract discrepancies
     text_content = Column(Text, nullable=True)
+    parse_source = Column(String, nullable=True)  # ParseSource: how the document text was obtained
     discrepancies = Column(JSON, nullable=True)
     reconciliation_notes = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    reconciliation_engine = Column(String, nullable=True)  # ReconciliationEngine: what decided the match
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     linked_invoices = relationship(
         "Document",
@@ -30,4 +36,33 @@ class Document(Base):
 
     @property
     def is_invoice(self):
-        return self.category == 'invoice'
\ No newline at end of file
+        return self.category == 'invoice'
+
+
+class DocumentAlias(Base):
+    """Another filename under which the content of an existing document was uploaded."""
+    __tablename__ = "document_aliases"
+
+    filename = Column(String, primary_key=True)
+    document_id = Column(String, ForeignKey("documents.id"), index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+def backfill_added_columns(connection: Connection, added: dict[str, list[str]]) -> None:
+    """Fills the columns added to an existing database (see DatabaseSessionManager.create_tables) from the older layout."""
+    if "status" not in added.get(Document.__tablename__, []):
+        return
+    documents = Document.__table__
+    # The processing state used to be stored in place of the category
+    connection.execute(
+        update(documents).where(documents.c.category.in_(["processing", "failed"]))
+        .values(status=documents.c.category, category=None)
+    )
+    connection.execute(update(documents).where(documents.c.category == "unknown").values(category=None))
+    connection.execute(update(documents).where(documents.c.category == "other").values(status="skipped"))
+    connection.execute(
+        update(documents)
+        .where(documents.c.status.is_(None), or_(documents.c.extracted_data.is_not(None), documents.c.text_content.is_not(None)))
+        .values(status="extracted")
+    )
+    connection.execute(update(documents).where(documents.c.status.is_(None)).values(status="processing"))
@@ -0,0 +1,29 @@
+from app.extraction.schemas import InvoiceData
+from app.extraction.services.candidates import (
+    ContractCandidateIndex,
+    normalize_vendor,
+    vendor_similarity,
+)
+from app.extraction.services.reconciliation import ReconciliationService
+
+
+def _index(*vendors: str) -> ContractCandidateIndex:
+    return ContractCandidateIndex([
+        {"id": f"c{i}", "filename": f"c{i}.pdf", "extracted_data": {"vendor_name": vendor}} for i, vendor in enumerate(vendors)
+    ])
+
+
+def test_short_vendor_names_match_their_long_form():
+    assert vendor_similarity(normalize_vendor("Globex"), normalize_vendor("Globex Logistics Inc.")) >= 0.6
+
+    index = _index("Initech LLC", "Globex Logistics Inc.")
+    assert [c["id"] for c in index.shortlist(InvoiceData(vendor_name="GLOBEX"))] == ["c1"]
+    assert ReconciliationService.is_affected(InvoiceData(vendor_name="Globex"), index)
+
+
+def test_closest_contracts_are_shortlisted_when_none_is_plausible():
+    index = _index("Initech LLC", "Globex Logistics Inc.", "Umbrella Corp")
+    invoice = InvoiceData(vendor_name="Globe Shipping Co")
+
+    assert [c["id"] for c in index.shortlist(invoice, k=2)] == ["c1", "c0"]
+    assert index.shortlist(invoice, fallback=False) == []
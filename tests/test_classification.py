@@ -0,0 +1,30 @@
+import pytest
+
+from app.extraction.schemas import DocumentCategory
+from app.extraction.services.classification import ClassificationService
+
+BODY = (
+    "Bill To: Globex Corporation\nInvoice No: 2024-117\nDue Date: 2024-02-15\n"
+    "Widgets 1,200.00\nGadgets 300.00\nShipping 25.00\nTotal Due 1,525.00\n"
+)
+
+
+def test_titled_invoice_is_classified_locally():
+    classification = ClassificationService._score_text_layer(["Acme Corp\nTAX INVOICE\n" + BODY])
+    assert classification.document_category == DocumentCategory.INVOICE
+    assert classification.confidence == 1.0
+
+
+@pytest.mark.parametrize("title", [
+    "Acme Corp\nCREDIT NOTE\nAgainst invoice 2024-100",
+    "Acme Corp\nStatement of Account\nOpen invoices",
+    "Acme Corp\nPURCHASE ORDER\nInvoice to: Acme Corp",
+    "Acme Corp\nQuotation\nInvoice will follow on delivery",
+])
+def test_lookalikes_mentioning_invoices_are_left_to_the_remote_classifier(title):
+    assert ClassificationService._score_text_layer([f"{title}\n{BODY}"]) is None
+
+
+def test_invoice_mentioned_below_the_title_is_left_to_the_remote_classifier():
+    page = "Acme Corp\n12 Main Street\nSpringfield\nRemittance advice for the invoice below\n" + BODY
+    assert ClassificationService._score_text_layer([page]) is None
@@ -0,0 +1,44 @@
+import asyncio
+import sqlite3
+
+from sqlalchemy import select
+
+from app.db import Base, DatabaseSessionManager
+from app.models import Document, backfill_added_columns
+
+
+def _create_old_database(path) -> None:
+    """The documents table as the first release created it, statuses stored in place of the category."""
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE documents (id VARCHAR PRIMARY KEY, filename VARCHAR UNIQUE, category VARCHAR, "
+            "contract_id VARCHAR REFERENCES documents (id), extracted_data JSON, text_content TEXT, discrepancies JSON, "
+            "reconciliation_notes TEXT, created_at DATETIME)"
+        )
+        conn.executemany("INSERT INTO documents (id, filename, category, extracted_data) VALUES (?, ?, ?, ?)", [
+            ("a", "a.pdf", "processing", None),
+            ("b", "b.pdf", "failed", None),
+            ("c", "c.pdf", "other", None),
+            ("d", "d.pdf", "invoice", '{"vendor_name": "Acme"}'),
+        ])
+
+
+def test_existing_database_is_upgraded_in_place(tmp_path):
+    path = tmp_path / "app.db"
+    _create_old_database(path)
+
+    async def upgrade():
+        manager = DatabaseSessionManager(f"sqlite+aiosqlite:///{path}")
+        await manager.create_tables(Base, backfill_added_columns)
+        async with manager.session() as db:
+            rows = (await db.execute(select(Document).order_by(Document.id))).scalars().all()
+            states = [(d.category, d.status, d.extraction_suspect) for d in rows]
+        await manager.close()
+        return states
+
+    assert asyncio.run(upgrade()) == [
+        (None, "processing", None), (None, "failed", None), ("other", "skipped", None), ("invoice", "extracted", None),
+    ]
+    with sqlite3.connect(path) as conn:
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(documents)")}
+    assert {"ix_documents_status", "ix_documents_content_hash"} <= indexes
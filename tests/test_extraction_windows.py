@@ -0,0 +1,39 @@
+from llama_index.core.utils import get_tokenizer
+
+from app.extraction.schemas import InvoiceData, LineItem
+from app.extraction.services.extraction import _merge_windows, _split_windows
+
+HEADER = "| Description | Qty | Unit | Amount |\n|---|---:|---|---|"
+
+
+def test_long_tables_repeat_their_header_in_every_window():
+    rows = [f"| item {i} | {i} | 10.00 | {i * 10}.00 |" for i in range(300)]
+    text = "INVOICE 123\nVendor: Acme\n\n" + HEADER + "\n" + "\n".join(rows) + "\n\nTotal: 44850.00"
+
+    windows = _split_windows(text, 400)
+
+    assert len(windows) > 2
+    table_windows = [w for w in windows if "| item" in w]
+    assert all(HEADER in w for w in table_windows)
+    # Rows stay whole, adjacent and in order
+    assert [line for w in table_windows for line in w.splitlines() if line.startswith("| item")] == rows
+
+
+def test_lines_over_the_budget_are_cut():
+    windows = _split_windows("word " * 2000 + "x" * 3000, 300)
+    tokenize = get_tokenizer()
+    assert all(len(tokenize(w)) <= 300 for w in windows)
+
+
+def test_merged_windows_skip_empty_values():
+    parts = [
+        InvoiceData(vendor_name="", invoice_number="INV-1", line_items=[LineItem(amount=10.0)]),
+        InvoiceData(vendor_name="Acme", invoice_number="INV-9", line_items=[LineItem(amount=20.0)], total_amount=30.0),
+        InvoiceData(vendor_name=" ", payment_terms=""),
+    ]
+
+    merged = _merge_windows(InvoiceData, parts)
+
+    assert (merged.vendor_name, merged.invoice_number, merged.total_amount) == ("Acme", "INV-1", 30.0)
+    assert merged.payment_terms is None
+    assert [item.amount for item in merged.line_items] == [10.0, 20.0]
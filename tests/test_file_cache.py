@@ -0,0 +1,30 @@
+import asyncio
+
+from app.extraction.cache import FileCache
+
+
+async def _chunks(size: int):
+    yield b"x" * size
+
+
+def _store(cache: FileCache, file_id: str, size: int = 100) -> None:
+    asyncio.run(cache.store(file_id, f"{file_id}.pdf", _chunks(size)))
+
+
+def test_files_in_use_are_not_evicted(tmp_path):
+    cache = FileCache(tmp_path, max_bytes=150)
+    with FileCache.in_use(["a", "b", "c"]):
+        for file_id in "abc":
+            _store(cache, file_id)
+        assert all(cache.get(file_id) for file_id in "abc")
+
+    _store(cache, "d")
+    assert [file_id for file_id in "abcd" if cache.get(file_id)] == ["d"]
+
+
+def test_modified_entries_are_discarded(tmp_path):
+    cache = FileCache(tmp_path)
+    _store(cache, "a")
+    with open(cache.get("a").path, "ab") as f:
+        f.write(b"y")
+    assert cache.get("a") is None
@@ -0,0 +1,45 @@
+import pytest
+
+from app.extraction.schemas import PaymentTerms
+from app.extraction.services.payment_terms import (
+    compare_payment_terms,
+    parse_payment_terms,
+)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Net 30 days", PaymentTerms(net_days=30)),
+    ("net30", PaymentTerms(net_days=30)),
+    ("Payable within 45 days", PaymentTerms(net_days=45)),
+    ("2/10 Net 30", PaymentTerms(net_days=30, discount_percent=2, discount_days=10)),
+    ("2/10, n/30", PaymentTerms(net_days=30, discount_percent=2, discount_days=10)),
+    ("2%/10 net 30", PaymentTerms(net_days=30, discount_percent=2, discount_days=10)),
+    ("1.5% 10 days, net 30", PaymentTerms(net_days=30, discount_percent=1.5, discount_days=10)),
+    ("2% discount if paid within 10 days, net 60", PaymentTerms(net_days=60, discount_percent=2, discount_days=10)),
+    ("Net 45 EOM", PaymentTerms(net_days=45, end_of_month=True)),
+    ("Net 30 days from end of month", PaymentTerms(net_days=30, end_of_month=True)),
+    ("Due on receipt", PaymentTerms(net_days=0, due_on_receipt=True)),
+    ("Payable immediately", PaymentTerms(net_days=0, due_on_receipt=True)),
+    ("Net 30 days upon receipt of invoice", PaymentTerms(net_days=30)),
+    ("Payable within 30 days upon receipt", PaymentTerms(net_days=30)),
+    ("Net 30, due 12/31/2024", PaymentTerms(net_days=30)),
+    ("Net 30 days from 01/15/2024", PaymentTerms(net_days=30)),
+    ("Net 30 days from 2024-01-15", PaymentTerms(net_days=30)),
+])
+def test_parse_payment_terms(text, expected):
+    assert parse_payment_terms(text) == expected
+
+
+@pytest.mark.parametrize("text", [None, "", "As agreed", "2% 10 Net 30", "Discount per schedule B, net 30", "Due 12/31/2024"])
+def test_unrecognised_terms_are_not_guessed(text):
+    assert parse_payment_terms(text) is None
+
+
+def test_compare_payment_terms_reports_differing_fields_only():
+    invoice = [PaymentTerms(net_days=30), PaymentTerms(net_days=45, discount_percent=2, discount_days=10)]
+    contract = [PaymentTerms(net_days=30), PaymentTerms(net_days=30, discount_percent=2, discount_days=10)]
+    result = compare_payment_terms(invoice, contract, ["Net 30", "2/10 net 45"], ["Net 30 days", "2/10 net 30"])
+
+    assert result[0] is None
+    assert result[1].field == "payment_terms"
+    assert result[1].issue == "Payment terms differ from the contract (net days 45 vs 30)"
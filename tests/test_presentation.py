@@ -0,0 +1,33 @@
+import asyncio
+
+from app.extraction.presentation import CHUNK_HEADER, ExtractionWebSocketHandler
+from app.extraction.services.ingestion import ChunkedUpload
+
+
+class RecordingHandler(ExtractionWebSocketHandler):
+    def __init__(self):
+        self.uploads = {}
+        self.errors = []
+
+    async def _send_upload_error(self, filename: str, error: str):
+        self.errors.append((filename, error))
+
+
+def test_short_upload_frames_are_reported_instead_of_raising():
+    handler = RecordingHandler()
+    asyncio.run(handler._handle_upload_chunk(b"\x00\x01"))
+    assert handler.errors == [("unknown file", "Malformed upload chunk received")]
+
+
+def test_upload_chunks_are_written_in_order():
+    handler = RecordingHandler()
+    handler.uploads[7] = upload = ChunkedUpload("invoice.pdf", 6)
+
+    async def send():
+        await handler._handle_upload_chunk(CHUNK_HEADER.pack(7, 0) + b"abc")
+        await handler._handle_upload_chunk(CHUNK_HEADER.pack(7, 3) + b"def")
+
+    asyncio.run(send())
+    upload.finish()
+    assert upload.file.read() == b"abcdef"
+    upload.close()
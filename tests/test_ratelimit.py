@@ -0,0 +1,61 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.extraction import ratelimit
+from app.extraction.ratelimit import ProviderLimiter, RateLimitedTransport
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_BASE_DELAY", 0.0)
+
+
+def _send(method: str, status_code: int, path: str = "/jobs", error: Exception | None = None) -> tuple[int, int]:
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if error:
+            raise error
+        return httpx.Response(status_code)
+
+    async def send() -> httpx.Response:
+        transport = RateLimitedTransport(
+            ProviderLimiter("test", 1000.0, 4), httpx.MockTransport(handler), max_retries=2, safe_post_paths=("/chat/completions",)
+        )
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.request(method, f"https://provider.test{path}")
+
+    try:
+        return asyncio.run(send()).status_code, len(calls)
+    except httpx.TransportError:
+        return 0, len(calls)
+
+
+@pytest.mark.parametrize("method", ["GET", "POST"])
+def test_throttled_requests_are_retried(method):
+    assert _send(method, 429) == (429, 3)
+
+
+def test_server_errors_of_idempotent_requests_are_retried():
+    assert _send("GET", 503) == (503, 3)
+
+
+def test_server_errors_of_posts_to_safe_endpoints_are_retried():
+    assert _send("POST", 502, path="/v1/chat/completions") == (502, 3)
+
+
+def test_server_errors_of_other_posts_are_not_retried():
+    assert _send("POST", 500) == (500, 1)
+
+
+@pytest.mark.parametrize("method, path, error, calls", [
+    ("GET", "/jobs", httpx.ReadTimeout("timed out"), 3),
+    ("POST", "/v1/chat/completions", httpx.RemoteProtocolError("connection reset"), 3),
+    ("POST", "/jobs", httpx.ConnectError("refused"), 3),
+    ("POST", "/jobs", httpx.ReadTimeout("timed out"), 1),
+])
+def test_connection_errors_are_retried_when_the_request_can_be_replayed(method, path, error, calls):
+    assert _send(method, 200, path=path, error=error) == (0, calls)
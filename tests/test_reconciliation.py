@@ -0,0 +1,21 @@
+from app.extraction import schemas
+from app.extraction.services import reconciliation
+from app.extraction.services.contracts import ContractSnapshot
+from app.extraction.services.reconciliation import ReconciliationService
+
+
+def test_invoices_sharing_contracts_are_planned_into_the_same_batch(monkeypatch):
+    monkeypatch.setattr(reconciliation, "RECONCILIATION_BATCH_SIZE", 2)
+    snapshot = ContractSnapshot(1, [
+        {"id": "a", "filename": "a.pdf", "extracted_data": {"vendor_name": "Acme Corp"}},
+        {"id": "g", "filename": "g.pdf", "extracted_data": {"vendor_name": "Globex Logistics"}},
+    ])
+    vendors = ["Acme", "Globex", "Acme", "Globex"]
+    items = [
+        schemas.InvoiceReconciliationInput(filename=f"i{i}.pdf", invoice_data=schemas.InvoiceData(vendor_name=vendor))
+        for i, vendor in enumerate(vendors)
+    ]
+
+    batches = ReconciliationService.plan_batches(items, snapshot, [None] * len(items))
+
+    assert sorted(sorted(batch) for batch in batches) == [[0, 2], [1, 3]]
@@ -0,0 +1,53 @@
+from app.extraction.schemas import InvoiceData, PaymentTerms
+from app.extraction.services.candidates import ContractCandidateIndex
+from app.extraction.services.rules import RuleBasedReconciler
+
+
+def _entries(**contract_data):
+    return ContractCandidateIndex([{"id": "c1", "filename": "c1.pdf", "extracted_data": contract_data}]).entries
+
+
+def test_exact_po_number_match_is_decided_locally():
+    entries = _entries(contract_number="PO-2024-17", vendor_name="Acme Corp")
+    decision = RuleBasedReconciler.reconcile(InvoiceData(purchase_order_number="po 2024/17", vendor_name="ACME Inc."), entries)
+    assert decision == ("c1", "Match (high): the invoice's PO number is contract number PO-2024-17.", [])
+
+
+def test_contract_number_inside_invoice_number_is_left_to_the_llm():
+    entries = _entries(contract_number="2024", vendor_name="Acme Corp")
+    assert RuleBasedReconciler.reconcile(InvoiceData(invoice_number="INV-2024-0117", vendor_name="Acme"), entries) is None
+
+
+def test_missing_vendor_is_left_to_the_llm():
+    entries = _entries(contract_number="2024", vendor_name="Acme Corp")
+    assert RuleBasedReconciler.reconcile(InvoiceData(purchase_order_number="2024"), entries) is None
+
+
+def test_payment_terms_of_all_decided_invoices_are_compared():
+    entries = _entries(contract_number="PO-1", vendor_name="Acme", payment_terms="Net 30 days")
+    invoices = [
+        InvoiceData(purchase_order_number="PO-1", vendor_name="Acme", payment_terms="Net 30"),
+        InvoiceData(purchase_order_number="PO-1", vendor_name="Acme", payment_terms="Net 45"),
+        InvoiceData(purchase_order_number="PO-2", vendor_name="Acme", payment_terms="Net 45"),
+    ]
+    decisions = RuleBasedReconciler.reconcile_many(invoices, entries)
+
+    assert decisions[0][2] == []
+    assert [d.issue for d in decisions[1][2]] == ["Payment terms differ from the contract (net days 45 vs 30)"]
+    assert decisions[2] is None
+
+
+def test_stored_invoice_terms_are_preferred_over_the_text():
+    entries = _entries(contract_number="PO-1", vendor_name="Acme", payment_terms="Net 30 days")
+    invoice = InvoiceData(purchase_order_number="PO-1", vendor_name="Acme", payment_terms="Thirty days net")
+    assert RuleBasedReconciler.reconcile(invoice, entries) is None
+    assert RuleBasedReconciler.reconcile(invoice, entries, PaymentTerms(net_days=30))[2] == []
+
+
+def test_payment_terms_on_one_side_only_are_left_to_the_llm():
+    entries = _entries(contract_number="PO-1", vendor_name="Acme", payment_terms="Net 30 days")
+    assert RuleBasedReconciler.reconcile(InvoiceData(purchase_order_number="PO-1", vendor_name="Acme"), entries) is None
+
+    entries = _entries(contract_number="PO-1", vendor_name="Acme")
+    invoice = InvoiceData(purchase_order_number="PO-1", vendor_name="Acme", payment_terms="Net 30")
+    assert RuleBasedReconciler.reconcile(invoice, entries) is None
@@ -0,0 +1,23 @@
+import openpyxl
+
+from app.extraction.services.spreadsheet import SpreadsheetService
+
+
+def _workbook(tmp_path, amount) -> str:
+    workbook = openpyxl.Workbook()
+    workbook.active.append(["Item", "Qty", "Price", "Amount"])
+    workbook.active.append(["Widget", 2, 3, amount])
+    path = str(tmp_path / "invoice.xlsx")
+    workbook.save(path)
+    return path
+
+
+def test_simple_workbook_is_read_locally(tmp_path):
+    text = SpreadsheetService.read_simple_workbook(_workbook(tmp_path, 6))
+    assert text.startswith("--- Region (table) ---")
+    assert "Widget" in text
+
+
+def test_formulas_without_cached_values_are_left_to_llamasheets(tmp_path):
+    # openpyxl, like most libraries, saves formulas without their computed result
+    assert SpreadsheetService.read_simple_workbook(_workbook(tmp_path, "=B2*C2")) is None
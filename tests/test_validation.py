@@ -0,0 +1,35 @@
+from app.extraction.schemas import InvoiceData, LineItem
+from app.extraction.services.validation import LineItemValidator
+
+
+def _invoice(total: float | None, subtotal: float | None = None, amounts: tuple = (100.0, 50.0)) -> InvoiceData:
+    return InvoiceData(
+        total_amount=total, subtotal=subtotal,
+        line_items=[LineItem(quantity=1, unit_price=amount, amount=amount) for amount in amounts],
+    )
+
+
+def test_total_with_unitemized_tax_is_not_flagged():
+    issues, suspect = LineItemValidator.validate([_invoice(total=165.0), _invoice(total=165.0, subtotal=150.0)])
+    assert issues == [[], []]
+    assert suspect == [False, False]
+
+
+def test_total_below_the_line_items_is_flagged():
+    issues, suspect = LineItemValidator.validate([_invoice(total=140.0)])
+    assert [issue.field for issue in issues[0]] == ["total_amount"]
+    assert suspect == [True]
+
+
+def test_subtotal_is_compared_with_the_line_items():
+    issues, suspect = LineItemValidator.validate([_invoice(total=200.0, subtotal=160.0)])
+    assert [(issue.field, issue.expected_value) for issue in issues[0]] == [("subtotal", "150.00 (sum of line items)")]
+    assert suspect == [True]
+
+
+def test_line_item_arithmetic():
+    invoice = InvoiceData(total_amount=33.0, line_items=[LineItem(quantity=3, unit_price=10.0, amount=33.0)])
+    issues, suspect = LineItemValidator.validate([invoice, InvoiceData()])
+    assert [issue.field for issue in issues[0]] == ["line_items[0].amount"]
+    assert issues[1] == []
+    assert suspect == [True, False]
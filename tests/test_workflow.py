@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from app import db as app_db
+from app.extraction import workflow as workflow_module
+from app.extraction.events import FileInfo
+from app.extraction.schemas import (
+    DocumentCategory,
+    DocumentClassification,
+    ExtractionOutput,
+    ProcessingStatus,
+)
+from app.extraction.services import passages
+from app.extraction.services.contracts import contract_snapshots
+from app.extraction.services.storage import StorageService
+from app.extraction.workflow import DocumentAutomationWorkflow
+from app.models import Document, DocumentAlias
+
+INVOICE = {"vendor_name": "Acme Corp", "purchase_order_number": "PO-1", "total_amount": 150.0, "line_items": [
+    {"description": "Widget", "quantity": 1, "unit_price": 100.0, "amount": 100.0},
+    {"description": "Gadget", "quantity": 1, "unit_price": 50.0, "amount": 50.0},
+]}
+
+
+class StubIngestion:
+    async def download_file(self, file_id: str) -> FileInfo:
+        return FileInfo(file_id=file_id, file_path=f"/tmp/{file_id}.pdf", filename=f"{file_id}.pdf")
+
+
+class StubClassification:
+    async def iter_classifications(self, db, files):
+        categories = {"i0": DocumentCategory.INVOICE, "i1": DocumentCategory.INVOICE, "c1": DocumentCategory.CONTRACT}
+        yield {
+            f.file_id: DocumentClassification(file_type="pdf", document_category=categories[f.file_id], confidence=1.0)
+            for f in files
+        }
+
+
+class StubExtraction:
+    def __init__(self):
+        self.extracted = []
+
+    async def extract(self, file_path, classification) -> ExtractionOutput:
+        self.extracted.append(file_path)
+        return ExtractionOutput(extracted_data=INVOICE)
+
+
+@pytest.fixture
+def sessionmanager(tmp_path, monkeypatch):
+    manager = app_db.DatabaseSessionManager(f"sqlite+aiosqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.setattr(workflow_module, "sessionmanager", manager)
+    monkeypatch.setattr(passages, "CONTRACT_INDEX_PATH", str(tmp_path / "contract_index.sqlite"))
+    passages.get_passage_index.cache_clear()
+    contract_snapshots.invalidate()
+    yield manager
+    passages.get_passage_index.cache_clear()
+    contract_snapshots.invalidate()
+
+
+async def _seed(manager) -> None:
+    await manager.create_tables(app_db.Base)
+    async with manager.session() as db:
+        db.add(Document(
+            id="c1", filename="c1.pdf", category=DocumentCategory.CONTRACT.value, status=ProcessingStatus.EXTRACTED.value,
+            extracted_data={"contract_number": "PO-1", "vendor_name": "Acme Corp"}, text_content="Contract PO-1 with Acme Corp",
+        ))
+        # Matched on data whose line items didn't add up
+        db.add(Document(
+            id="i0", filename="i0.pdf", category=DocumentCategory.INVOICE.value, status=ProcessingStatus.EXTRACTED.value,
+            extracted_data={**INVOICE, "total_amount": 999.0, "matched_contract_id": "c1"}, extraction_suspect=True,
+            contract_id="c1", reconciliation_notes="Match (high): old data.", reconciliation_engine="llm",
+            discrepancies=[{"field": "total_amount", "invoice_value": "999.0", "contract_value": "150.0", "issue": "Too high"}],
+        ))
+        # Reconciled by an earlier run, then uploaded again under another name
+        db.add(Document(
+            id="i1", filename="i1.pdf", category=DocumentCategory.INVOICE.value, status=ProcessingStatus.EXTRACTED.value,
+            extracted_data={**INVOICE, "matched_contract_id": "c1"}, contract_id="c1",
+            reconciliation_notes="Match (high): stored.", reconciliation_engine="rules", discrepancies=[],
+        ))
+        db.add(DocumentAlias(filename="i1 copy.pdf", document_id="i1"))
+
+
+async def _run(manager, filenames: list[str]):
+    await _seed(manager)
+    async with manager.session() as db:
+        file_ids = await StorageService.get_file_ids_by_filenames(db, filenames)
+    workflow = DocumentAutomationWorkflow(timeout=10)
+    workflow.ingestion, workflow.classification = StubIngestion(), StubClassification()
+    workflow.extraction = extraction = StubExtraction()
+    results = await workflow.run(file_ids=file_ids)
+    async with manager.session() as db:
+        invoice = await db.get(Document, "i0")
+    await manager.close()
+    return results, invoice, extraction
+
+
+@pytest.mark.parametrize("filenames", [["i0.pdf"], ["i0.pdf", "c1.pdf"]])
+def test_suspect_matched_invoices_are_reconciled_again(sessionmanager, filenames):
+    results, invoice, extraction = asyncio.run(_run(sessionmanager, filenames))
+
+    assert extraction.extracted == ["/tmp/i0.pdf"]
+    result = next(r for r in results if r.file_id == "i0")
+    assert result.matched_contract_id == "c1"
+    assert result.reconciliation_notes.startswith("Match (high): the invoice's PO number")
+    assert invoice.extraction_suspect is False
+    assert invoice.arithmetic_issues is None
+    assert invoice.discrepancies == []
+    assert invoice.reconciliation_engine == "rules"
+    assert invoice.extracted_data["total_amount"] == 150.0
+
+
+def test_duplicate_of_a_matched_invoice_completes_with_its_stored_result(sessionmanager):
+    results, _, extraction = asyncio.run(_run(sessionmanager, ["i1 copy.pdf", "i0.pdf"]))
+
+    assert extraction.extracted == ["/tmp/i0.pdf"]
+    result = next(r for r in results if r.file_id == "i1")
+    assert (result.matched_contract_id, result.reconciliation_notes) == ("c1", "Match (high): stored.")
+    assert len(results) == 2